@@ -1,26 +1,35 @@
-import copy
- 
-def check_clear(board):
-    cleared_count = 0
+import logging
+import time
+from collections import OrderedDict, namedtuple
+from itertools import islice
+
+from bitboard import (ROW_MASKS, COL_MASKS, to_bits, to_board, shape_key, block_mask, placements, clear_lines,
+                      fragmentation, row_fills, col_fills, lines_within)
+
+log = logging.getLogger(__name__)
+
+TABLE_SIZE = 1 << 18  # positions kept in the transposition table
 
-    # Make a fresh copy of the board's rows.
-    board_copy = [row[:] for row in board]
+# Scoring for best_moves
+CLEAR_SCORE = 20  # per line cleared
+EMPTY_SCORE = 2  # per empty cell left on the board
+FRAGMENT_SCORE = 1  # taken off per filled cell / empty cell pair that sit side by side
+SEEN_LIMIT = 1 << 20  # positions best_moves remembers so it doesn't search them twice
 
-    # Check and clear full rows.
-    for n, row in enumerate(board_copy):
-        if len(set(row)) == 1 and row[0] == 1:  # If all elements in the row are 1 (blocks)
-            board[n] = [0 for _ in range(8)]
-            cleared_count += 1
+LINE_MASKS = ROW_MASKS + COL_MASKS
 
-    # Transpose board to check columns as if they were rows idk I didn't write this line
-    board_copy = list(zip(*board_copy[::-1]))
+# One placement of a solution: the index of the piece in the hand, the row/col its (trimmed) top left corner goes to
+# and how many lines it cleared. Small enough to keep lots of them around or send them anywhere.
+Move = namedtuple("Move", ("piece", "row", "col", "clears"))
 
-    # Check and clear full columns.
-    for n, i in enumerate(board_copy):
-        if len(set(i)) == 1 and i[0] == 1:  # If all elements in the column are 1
-            for m in range(8):
-                board[m][n] = 0  # Clear the column
-                cleared_count += 1
+
+def check_clear(board):
+    # Clears the full rows and columns of a board in place. Returns (board, lines cleared), a cell where a full row
+    # crosses a full column counting for both lines but only being cleared once.
+    bits, cleared_count = clear_lines(to_bits(board))
+    if cleared_count:
+        for n, row in enumerate(to_board(bits)):
+            board[n] = row
 
     return board, cleared_count
 
@@ -57,68 +66,475 @@ def print_board(board):
     print("-" * 24)
 
 
-def make_moves(board, tiles, required_clear_count=1):
-    def backtrack(b, current_block, clear_count, visual_overlay, correct_tile, must_clear):
-        # Termination: if all three blocks have been placed
-        if current_block == 3:
-            # If a clear is required, check that we achieved enough clears
-            if must_clear:
-                if clear_count >= required_clear_count:
-                    return b, visual_overlay
-                else:
-                    return None
-            else:
-                return b, visual_overlay
-
-        # Try every board position for the current block
-        for row in range(9):
-            for col in range(9):
-                board_copy = copy.deepcopy(b)
-                overlay_copy = copy.deepcopy(visual_overlay)
-
-                # Try placing the current block
-                can_place, new_board = add_tile(board_copy, correct_tile[current_block].tile_data, row, col,
-                                                overlay_copy,
-                                                current_block)
-                if not can_place:
-                    continue  # Skip invalid placements
-
-                # Clear rows/columns and get the number of clears from this placement
-                new_board, new_clears = check_clear(new_board)
-                total_clear_count = clear_count + new_clears
-
-                # Recurse to place the next block.
-                result = backtrack(new_board, current_block + 1, total_clear_count, overlay_copy, correct_tile,
-                                   must_clear)
-
-                if result is not None:
-                    return result
+class OutOfTime(Exception):
+    pass
+
+
+class Cancelled(OutOfTime):
+    pass
+
+
+def block_spots(shapes):
+    # The shapes' block ids (a trimmed shape's mask doubles as its id, so identical blocks share one) and every spot
+    # each block can go on the board, {block id: [mask, ...]}. Shapes repeat from hand to hand, so the spots come from
+    # the shared placement index.
+    block_ids = [block_mask(shape) for shape in shapes]
+    spots = {block_id: [mask for _, _, mask in placements(shape)] for block_id, shape in zip(block_ids, shapes)}
+    return block_ids, spots
 
-                    # No valid placement found for this branch.
-        return None
 
-    initial_board = copy.deepcopy(board)
-    initial_overlay = [[[0, 0, 0] for _ in range(8)] for _ in range(8)]
+def next_blocks(blocks_left):
+    # (block id, the blocks left after it) for every block that can go next. blocks_left is sorted, so a block equal
+    # to the one before it would only repeat the same search and is skipped.
+    for n, block_id in enumerate(blocks_left):
+        if not n or block_id != blocks_left[n - 1]:
+            yield block_id, blocks_left[:n] + blocks_left[n + 1:]
 
-    for i in range(6):  # goes through 6 times for sequencing
-        new_tiles = tiles[:]
-        correct_tiles = [new_tiles.pop(i % 3)]
-        extra_tiles = new_tiles[:2]
-        if i > 2:
-            extra_tiles.reverse()
-        correct_tiles.extend(extra_tiles)
 
-        result = backtrack(initial_board, 0, 0, initial_overlay, correct_tiles, must_clear=True)
+class TranspositionTable:
+    # Remembers how already searched positions turned out, keyed on (board, blocks left, clears still needed).
+    # A failed position is stored as False and a solved one as (final board, (block id, mask) placed from there on).
+    def __init__(self, max_size=TABLE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        result = self.entries.get(key)
         if result is not None:
-            print("Solved with a clear")
-            return result
-
-    # Fallback: if no solution with the required clears is found, relax the requirement.
-    print("No solution with required clears found. Falling back to non-clearing solution")
-    result = backtrack(initial_board, 0, 0, initial_overlay, tiles, must_clear=False)
-    if result is not None:
-        print("Solved without a clear")
+            self.entries.move_to_end(key)
         return result
-    else:
-        print("No solution")
+
+    def put(self, key, result):
+        if self.max_size <= 0:
+            return
+        self.entries[key] = result
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)  # drop the least recently used position
+
+    def clear(self):
+        self.entries.clear()
+
+
+# Shared by every make_moves call, so a session that keeps loading cases keeps it warm
+transposition_table = TranspositionTable()
+
+
+def make_moves(board, tiles, required_clear_count=1, table=None, stats=None):
+    # Returns (final board, [Move, ...]), or (None, None) if the tiles don't fit
+    started = time.perf_counter()
+    shapes = [shape_key(tile.tile_data) for tile in tiles]
+    bits = to_bits(board)
+    result, cleared = search_moves(bits, shapes, required_clear_count, table, stats=stats)
+
+    if not cleared:
+        log.info("No solution with required clears found. Falling back to non-clearing solution")
+    if result is None:
+        log_solve("No solution", started, stats, outcome="none")
         return None, None
+
+    if cleared:
+        log_solve("Solved with a clear", started, stats, outcome="cleared")
+    else:
+        log_solve("Solved without a clear", started, stats, outcome="placed")
+    return to_board(result[0]), to_moves(bits, result[1], [block_mask(shape) for shape in shapes])[0]
+
+
+def log_solve(message, started, stats, **fields):
+    # One log line per solve. The fields (and stats, if any) also go on the record as `solve` for log handlers
+    # that want them structured.
+    fields["seconds"] = time.perf_counter() - started
+    if stats is not None:
+        fields["stats"] = stats.as_dict()
+        message += f" {stats}"
+    log.info("%s in %.4fs", message, fields["seconds"], extra={"solve": fields})
+
+
+def search_moves(bits, shapes, required_clear_count=1, table=None, time_budget=None, stats=None, cancel=None):
+    # make_moves on a bitboard and a list of shape_keys, without printing.
+    # Returns ((final bits, ((block id, mask), ...)) or None, whether the required clears were met).
+    # Raises OutOfTime if time_budget (seconds) runs out first, or Cancelled as soon as cancel(), an optional
+    # callable, returns True. stats is an optional SearchStats to fill in.
+    if table is None:
+        table = transposition_table
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    interruptible = deadline is not None or cancel is not None
+
+    cache_before = placements.cache_info()
+    block_ids, spots = block_spots(shapes)
+    blocks = tuple(sorted(block_ids))
+    cells = {block_id: block_id.bit_count() for block_id in block_ids}
+    spans = {block_id: block_span(block_id) for block_id in block_ids}
+
+    complete = 0  # complete placements reached so far, clearing or not
+    nodes = 0
+    detail = stats is not None and stats.detail
+
+    def backtrack(bits, blocks_left, need):
+        nonlocal complete, nodes
+
+        # Termination: if all the blocks have been placed, check that we achieved enough clears
+        if not blocks_left:
+            complete += 1
+            if need > 0:
+                return None
+            return bits, ()
+
+        key = (bits, blocks_left, need)
+        known = table.get(key)
+        if detail:
+            if known is None:
+                stats.table_misses += 1
+            else:
+                stats.table_hits += 1
+        if known is not None:
+            if known is False and need and table.get((bits, blocks_left, 0)) is not False:
+                complete += 1  # the stored failure may have had complete placements under it
+            return known or None
+
+        # Unwinding with an exception means nothing half searched gets stored in the table
+        nodes += 1
+        if interruptible and not nodes % 1024:
+            if deadline is not None and time.perf_counter() > deadline:
+                raise OutOfTime
+            if cancel is not None and cancel():
+                raise Cancelled
+
+        depth = len(blocks) - len(blocks_left)
+        if detail:
+            stats.node(depth, bits, blocks_left)
+
+        planes = ()
+        if need:
+            cells_left = sum(cells[b] for b in blocks_left)
+            rows, cols = row_fills(bits), col_fills(bits)
+            reachable = min(sum(spans[b] for b in blocks_left),
+                            lines_within(rows, cells_left) + lines_within(cols, cells_left))
+            if reachable < need:
+                # Can't clear enough from here, though the blocks might still fit, so this doesn't count as a dead
+                # end for the fallback
+                if detail:
+                    stats.pruned += 1
+                complete += 1
+                table.put(key, False)
+                return None
+            if len(blocks_left) > 1:
+                planes = fill_planes(rows, cols, cells_left)
+        complete_before = complete
+
+        # Pick which block goes next
+        for block_id, rest in next_blocks(blocks_left):
+            started = time.perf_counter() if detail and not depth else None
+            checks = 0
+
+            # Every spot the block fits on the board. While clears are still needed and more blocks follow this one,
+            # the spots that go into the fullest lines that can still be finished go first.
+            masks = [mask for mask in spots[block_id] if not bits & mask]
+            if need and rest:
+                masks.sort(key=lambda mask: fill_score(mask, planes), reverse=True)
+
+            for mask in masks:
+                # Place the block, then clear rows/columns and count the clears from this placement
+                checks += 1
+                new_bits, new_clears = clear_lines(bits | mask)
+
+                # Recurse to place the remaining blocks.
+                found = backtrack(new_bits, rest, max(need - new_clears, 0))
+                if found is not None:
+                    if detail:
+                        stats.block_tried(depth, block_id, len(spots[block_id]), len(masks), checks, started)
+                    result = found[0], ((block_id, mask),) + found[1]
+                    table.put(key, result)
+                    return result
+
+            if detail:
+                stats.block_tried(depth, block_id, len(spots[block_id]), len(masks), checks, started)
+
+        # No valid placement found for this branch.
+        table.put(key, False)
+        if need and complete == complete_before:
+            table.put((bits, blocks_left, 0), False)  # nothing fits at all, so the fallback can skip it too
+        return None
+
+    if detail:
+        stats.begin(list(zip(block_ids, shapes)), cache_before, placements.cache_info())
+    started = time.perf_counter()
+    phase = "clear"
+    try:
+        # One search covers every order the blocks can be placed in
+        result = backtrack(bits, blocks, required_clear_count)
+        if result is not None:
+            return result, True
+
+        # Fallback: if no solution with the required clears is found, relax the requirement.
+        if detail:
+            stats.phase(phase, started)
+        started = time.perf_counter()
+        phase = "fallback"
+        return backtrack(bits, blocks, 0), False
+    finally:
+        if stats is not None:
+            stats.nodes += nodes
+        if detail:
+            stats.phase(phase, started)
+            stats.end()
+
+
+def iter_moves(bits, shapes, required_clear_count=1, limit=None, key=None, time_budget=None, cancel=None):
+    # Yields the distinct ways the blocks can be placed, as (final bits, ((block id, mask), ...), lines cleared), one
+    # per final board and only those clearing at least required_clear_count lines. The search only runs as far as
+    # it needs to for the next one, so stopping early costs nothing and asking for more carries on where it left off.
+    # limit stops after that many. With a sort key (like solution_score) the whole search runs first and they come
+    # out best first. Stops early once time_budget (seconds) runs out, and raises Cancelled as soon as cancel(), an
+    # optional callable, returns True.
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    block_ids, spots = block_spots(shapes)
+    finals = set()
+    seen = set()
+    nodes = 0
+
+    def backtrack(bits, blocks_left, clears, path):
+        nonlocal nodes
+        if not blocks_left:
+            if clears >= required_clear_count and bits not in finals:
+                finals.add(bits)
+                yield bits, path, clears
+            return
+
+        # Whatever is reachable from here has been yielded already if the same board was reached with the same blocks
+        # left and as many of the required clears
+        seen_key = (bits, blocks_left, min(clears, required_clear_count))
+        if seen_key in seen:
+            return
+        if len(seen) < SEEN_LIMIT:
+            seen.add(seen_key)
+
+        nodes += 1
+        if not nodes % 1024:
+            if deadline is not None and time.perf_counter() > deadline:
+                raise OutOfTime
+            if cancel is not None and cancel():
+                raise Cancelled
+
+        for block_id, rest in next_blocks(blocks_left):
+            for mask in spots[block_id]:
+                if not bits & mask:
+                    new_bits, new_clears = clear_lines(bits | mask)
+                    yield from backtrack(new_bits, rest, clears + new_clears, path + ((block_id, mask),))
+
+    def search():
+        try:
+            yield from backtrack(bits, tuple(sorted(block_ids)), 0, ())
+        except Cancelled:
+            raise
+        except OutOfTime:
+            return
+
+    solutions = search()
+    if key is not None:
+        solutions = sorted(solutions, key=key, reverse=True)
+    yield from islice(solutions, limit)
+
+
+def fill_planes(rows, cols, cells_left):
+    # How full the rows and columns that cells_left more cells could still finish are (rows and cols as row_fills
+    # and col_fills give them), in binary: planes[n] has the rows with bit n of their filled cell count set,
+    # planes[3 + n] the columns
+    planes = [0] * 6
+    for n, filled in enumerate(rows + cols):
+        if 8 - filled <= cells_left:
+            for bit in range(3):
+                if filled >> bit & 1:
+                    planes[n // 8 * 3 + bit] |= LINE_MASKS[n]
+    return planes
+
+
+def fill_score(mask, planes):
+    # Move ordering for clears: each of the mask's cells counts as many as its row and column have filled, for the
+    # lines in fill_planes
+    r1, r2, r4, c1, c2, c4 = planes
+    return ((mask & r1).bit_count() + (mask & c1).bit_count() + 2 * ((mask & r2).bit_count() + (mask & c2).bit_count())
+            + 4 * ((mask & r4).bit_count() + (mask & c4).bit_count()))
+
+
+def solution_score(solution):
+    # Sort key for iter_moves: score_board of the final board
+    final_bits, _, clears = solution
+    return score_board(final_bits, clears)
+
+
+def score_board(bits, clears):
+    empty = 64 - bits.bit_count()
+    return clears * CLEAR_SCORE + empty * EMPTY_SCORE - fragmentation(bits) * FRAGMENT_SCORE
+
+
+def score_bound(bits, cells, span, clears):
+    # Highest score still reachable by placing blocks with `cells` cells in total, covering `span` rows plus columns.
+    # A block can't finish more lines than it covers, and the lines it finishes need their gaps filled.
+    more_clears = min(span, lines_within(row_fills(bits), cells) + lines_within(col_fills(bits), cells))
+
+    empty = min(64, 64 - bits.bit_count() - cells + 8 * more_clears)
+    return (clears + more_clears) * CLEAR_SCORE + empty * EMPTY_SCORE
+
+
+def block_span(block_id):
+    # Rows plus columns a block covers
+    rows = sum(1 for mask in ROW_MASKS if block_id & mask)
+    cols = sum(1 for mask in COL_MASKS if block_id & mask)
+    return rows + cols
+
+
+def best_moves(board, tiles, time_budget=None, stats=None):
+    # Anytime version of make_moves: instead of stopping at the first placement with a clear, it keeps looking
+    # for the highest score_board placement and returns the best one found once time_budget (seconds) runs out.
+    # optimal is True when the whole search finished, so nothing better exists. Returns (board, moves, optimal).
+    started = time.perf_counter()
+    shapes = [shape_key(tile.tile_data) for tile in tiles]
+    bits = to_bits(board)
+    result, score, optimal = search_best_moves(bits, shapes, time_budget, stats)
+
+    if result is None:
+        log_solve("No solution", started, stats, outcome="none", optimal=optimal)
+        return None, None, optimal
+
+    message = f"Best solution scores {score}" + (" (optimal)" if optimal else " (out of time)")
+    log_solve(message, started, stats, outcome="best", score=score, optimal=optimal)
+    return to_board(result[0]), to_moves(bits, result[1], [block_mask(shape) for shape in shapes])[0], optimal
+
+
+def search_best_moves(bits, shapes, time_budget=None, stats=None, shared=None, cancel=None):
+    # best_moves on a bitboard and a list of shape_keys, without printing.
+    # Returns ((final bits, ((block id, mask), ...)) or None, its score, optimal). stats works like in search_moves.
+    # shared is an optional score shared with searches running elsewhere (like parallel.SharedBound): get() is the
+    # best any of them has found, or None, and offer(score) tells them about a better one. Branches that can't beat
+    # it are skipped too, so the placement returned can be worse than the shared one, or None. cancel is an optional
+    # callable that stops the search like running out of time when it returns True.
+    cache_before = placements.cache_info()
+    block_ids, spots = block_spots(shapes)
+    blocks = tuple(sorted(block_ids))
+    cells = {block_id: block_id.bit_count() for block_id in block_ids}
+    spans = {block_id: block_span(block_id) for block_id in block_ids}
+
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    out_of_time = False
+    nodes = 0
+    detail = stats is not None and stats.detail
+
+    best_score = None
+    best = None
+    seen = set()
+    outside = None if shared is None else shared.get()
+
+    def backtrack(bits, blocks_left, clears, path):
+        nonlocal out_of_time, nodes, best_score, best, outside
+
+        if not blocks_left:
+            score = score_board(bits, clears)
+            if best_score is None or score > best_score:
+                best_score, best = score, (bits, path)
+                if shared is not None:
+                    shared.offer(score)
+            return
+
+        # The same board with the same blocks and clears can be reached in different orders,
+        # and the best score only goes up, so a repeat can never find anything new
+        key = (bits, blocks_left, clears)
+        if key in seen:
+            if detail:
+                stats.table_hits += 1
+            return
+        if detail:
+            stats.table_misses += 1
+        if len(seen) < SEEN_LIMIT:
+            seen.add(key)
+
+        # Branch and bound: skip the branch if it can't beat the best placement so far (or the shared one)
+        beat = best_score if outside is None or best_score is not None and best_score > outside else outside
+        if beat is not None:
+            bound = score_bound(bits, sum(cells[b] for b in blocks_left), sum(spans[b] for b in blocks_left), clears)
+            if bound <= beat:
+                if detail:
+                    stats.pruned += 1
+                return
+
+        nodes += 1
+        if not nodes % 256:
+            if deadline is not None and time.perf_counter() > deadline or cancel is not None and cancel():
+                out_of_time = True
+            if shared is not None:
+                outside = shared.get()
+        if out_of_time:
+            return
+
+        depth = len(blocks) - len(blocks_left)
+        if detail:
+            stats.node(depth, bits, blocks_left)
+
+        for block_id, rest in next_blocks(blocks_left):
+            started = time.perf_counter() if detail and not depth else None
+
+            # Placements that clear something go first, so good answers turn up early
+            children = []
+            for mask in spots[block_id]:
+                if not bits & mask:
+                    new_bits, new_clears = clear_lines(bits | mask)
+                    children.append((new_clears, mask, new_bits))
+            children.sort(key=lambda child: child[0], reverse=True)
+
+            for new_clears, mask, new_bits in children:
+                backtrack(new_bits, rest, clears + new_clears, path + ((block_id, mask),))
+                if out_of_time:
+                    break
+
+            if detail:
+                stats.block_tried(depth, block_id, len(spots[block_id]), len(children), len(children), started)
+            if out_of_time:
+                return
+
+    if detail:
+        stats.begin(list(zip(block_ids, shapes)), cache_before, placements.cache_info())
+    started = time.perf_counter()
+    backtrack(bits, blocks, 0, ())
+    if stats is not None:
+        stats.nodes += nodes
+    if detail:
+        stats.phase("best", started)
+        stats.end()
+    return best, best_score, not out_of_time
+
+
+def to_moves(bits, path, block_ids, hand=None):
+    # Turns a search path into Moves, block_ids[n] being the id of piece n and hand the indexes of the pieces the
+    # search placed (all of them by default). Also returns the final bitboard.
+    unused = list(range(len(block_ids)) if hand is None else hand)
+    moves = []
+    for block_id, mask in path:
+        piece = next(n for n in unused if block_ids[n] == block_id)
+        unused.remove(piece)
+
+        row, col = divmod(lowest_bit(mask) - lowest_bit(block_id), 8)
+        bits, clears = clear_lines(bits | mask)
+        moves.append(Move(piece, row, col, clears))
+    return moves, bits
+
+
+def lowest_bit(bits):
+    return (bits & -bits).bit_length() - 1
+
+
+def move_masks(moves, shapes):
+    # The cells each move fills, shapes being the shape_keys of the hand the moves were found for
+    return [block_mask(shapes[move.piece]) << (move.row * 8 + move.col) for move in moves]
+
+
+def build_overlay(path):
+    # Colours the cells of the n-th placed block with colour channel n (red, green, then blue)
+    visual_overlay = [[[0, 0, 0] for _ in range(8)] for _ in range(8)]
+    for current_block, mask in enumerate(path):
+        for r in range(8):
+            for c in range(8):
+                if mask >> (r * 8 + c) & 1:
+                    visual_overlay[r][c][current_block] = 255
+    return visual_overlay
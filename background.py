@@ -0,0 +1,138 @@
+# Solving in a worker process, so the game keeps drawing frames while a hard hand is searched.
+# Every position handed to the worker gets a number. The latest number lives in shared memory, and a search
+# stops as soon as it sees that it's no longer solving the latest position.
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from ai import OutOfTime, Cancelled, search_moves, iter_moves, to_moves
+from bitboard import to_bits, to_board, shape_key, block_mask
+from parallel import ParallelSearch
+
+SPLIT_AFTER = 0.25  # seconds a position gets on one core before it's split over all of them
+
+latest = None  # the worker's view of the shared position number
+# (number, board bits, block ids, iter_moves generator, cleared, final board already shown) for the last position the
+# worker solved, so asking for another solution carries on from where the last one was found
+alternatives = None
+splitter = None  # the worker's ParallelSearch, started the first time a position needs it
+
+
+def start_worker(shared):
+    global latest
+    latest = shared
+
+
+def solve_position(number, board, pieces, required_clear_count):
+    # Runs in the worker. Returns (number, (board, [Move, ...]) or None, cleared, seconds), or None if it was
+    # cancelled.
+    global alternatives
+    if latest.value != number:
+        return None  # the position changed while this one waited its turn
+    started = time.perf_counter()
+    alternatives = None
+    bits, shapes = to_bits(board), [shape_key(piece) for piece in pieces]
+    cancel = lambda: latest.value != number
+    split = os.cpu_count() > 1
+    try:
+        result, cleared = search_moves(bits, shapes, required_clear_count, time_budget=SPLIT_AFTER if split else None,
+                                       cancel=cancel)
+    except Cancelled:
+        return None
+    except OutOfTime:
+        # A hard one, so every core gets a share of it
+        try:
+            result, cleared = split_search().search_moves(bits, shapes, required_clear_count, cancel=cancel)
+        except Cancelled:
+            return None
+    if result is None:
+        return number, None, cleared, time.perf_counter() - started
+
+    # Nothing is searched for the alternatives until they're asked for
+    solutions = iter_moves(bits, shapes, required_clear_count if cleared else 0, cancel=cancel)
+    block_ids = [block_mask(shape) for shape in shapes]
+    alternatives = (number, bits, block_ids, solutions, cleared, result[0])
+    return number, to_solution(bits, result, block_ids), cleared, time.perf_counter() - started
+
+
+def split_search():
+    global splitter
+    if splitter is None:
+        splitter = ParallelSearch()
+    return splitter
+
+
+def next_solution(number):
+    # Runs in the worker. Finds another solution of the position solve_position last solved, with a different final
+    # board from every one found for it before. Returns like solve_position, with no solution once there are none
+    # left, or None if the position has changed.
+    global alternatives
+    started = time.perf_counter()
+    if alternatives is None or alternatives[0] != number:
+        return None
+    _, bits, block_ids, solutions, cleared, shown = alternatives
+    try:
+        for final_bits, path, _ in solutions:
+            if final_bits != shown:
+                return number, to_solution(bits, (final_bits, path), block_ids), cleared, time.perf_counter() - started
+    except Cancelled:
+        alternatives = None
+        return None
+    return number, None, cleared, time.perf_counter() - started
+
+
+def to_solution(bits, result, block_ids):
+    # A search result as (final board, moves), which is all that goes back to the game
+    final_bits, path = result
+    return to_board(final_bits), to_moves(bits, path, block_ids)[0]
+
+
+class BackgroundSolver:
+    def __init__(self, required_clear_count=1):
+        self.required_clear_count = required_clear_count
+        # Spawned rather than forked, so the worker doesn't inherit the game's window
+        context = multiprocessing.get_context("spawn")
+        self.latest = context.RawValue("l", 0)
+        self.pool = ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=start_worker,
+                                        initargs=(self.latest,))
+        self.future = None
+
+    @property
+    def solving(self):
+        return self.future is not None
+
+    def submit(self, board, pieces):
+        # Starts solving a copy of the position, cancelling whatever was being solved before
+        self.cancel()
+        board = [list(row) for row in board]
+        pieces = [[list(row) for row in piece] for piece in pieces]
+        self.future = self.pool.submit(solve_position, self.latest.value, board, pieces, self.required_clear_count)
+
+    def more(self):
+        # Asks for another solution of the last position solved, which poll hands over like the first one. It's
+        # None there once every solution has been found.
+        if self.future is None:
+            self.future = self.pool.submit(next_solution, self.latest.value)
+
+    def cancel(self):
+        # The running search (if any) stops at its next check and its result is thrown away. One that hasn't started
+        # yet never does.
+        self.latest.value += 1
+        if self.future is not None:
+            self.future.cancel()
+        self.future = None
+
+    def poll(self):
+        # (solution, cleared, seconds) once the latest submitted position is solved, otherwise None.
+        # solution is (board, [Move, ...]), or None if the blocks don't fit. Never waits.
+        if self.future is None or not self.future.done():
+            return None
+        done, self.future = self.future.result(), None
+        if done is None or done[0] != self.latest.value:
+            return None  # solved a position that has changed since
+        return done[1:]
+
+    def close(self):
+        self.cancel()
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,57 @@
+# Solving a big pile of cases across a pool of worker processes.
+# Workers stay alive for the whole batch, so each one's placement index and transposition table stay warm.
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+
+from solver import solve_line
+
+CHUNKS_PER_WORKER = 4  # chunks queued up per worker so none of them sit idle waiting for the next one
+
+
+def solve_chunk(chunk, mode, required_clear_count, timeout, stats=False, cache=None, alternatives=0):
+    # Lookahead gets one process per case here, since the cases are already spread over the workers
+    return [(key, solve_line(line, mode, required_clear_count, timeout, stats, workers=1, cache=cache,
+                             alternatives=alternatives))
+            for key, line in chunk]
+
+
+def solve_batch(cases, workers=None, chunk_size=16, mode="first", required_clear_count=1, timeout=None,
+                ordered=True, stats=False, cache=None, alternatives=0):
+    # Solves (key, line) pairs of cases.txt lines and yields (key, result) for each one, in the order they came in
+    # or, if ordered is False, as soon as they're done. workers defaults to one per core, timeout is per case.
+    # stats adds each search's counters to its result, cache is the path of a solution cache file to share.
+    # alternatives is passed on to solve.
+    workers = workers or os.cpu_count()
+    cases = iter(cases)
+    chunks = iter(lambda: list(islice(cases, chunk_size)), [])
+
+    if workers == 1:
+        for chunk in chunks:
+            yield from solve_chunk(chunk, mode, required_clear_count, timeout, stats, cache, alternatives)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        def submit():
+            chunk = next(chunks, None)
+            if chunk is None:
+                return None
+            return pool.submit(solve_chunk, chunk, mode, required_clear_count, timeout, stats, cache,
+                               alternatives)
+
+        pending = deque(filter(None, (submit() for _ in range(workers * CHUNKS_PER_WORKER))))
+
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+
+            for future in done:
+                yield from future.result()
+                future = submit()
+                if future is not None:
+                    pending.append(future)
@@ -0,0 +1,202 @@
+# Solver benchmarks: seeded positions in a few difficulty tiers, solved under one or more solver settings.
+# Reports solve latency percentiles, nodes searched per second and peak memory for every tier and setting,
+# and can fail a run that got slower than a saved baseline.
+import argparse
+import json
+import math
+import random
+import sys
+import time
+import tracemalloc
+
+from ai import TranspositionTable, transposition_table, search_moves
+from bitboard import to_board, shape_key, placements, clear_lines
+from pieces import PIECES, random_hand
+from solver import MODES, solve
+
+TIERS = ("easy", "clear", "infeasible", "dense")
+PERCENTILES = (50, 95, 99)
+
+
+def play_random(rng, bits, moves):
+    # Drops random pieces at random spots (clearing lines as it goes) to get a board that looks like a real game
+    for _ in range(moves):
+        piece = rng.choice(PIECES)
+        spots = [mask for _, _, mask in placements(piece) if not bits & mask]
+        if not spots:
+            continue
+        bits, _ = clear_lines(bits | rng.choice(spots))
+    return bits
+
+
+def classify(bits, hand):
+    # "clear" if the hand can clear a line, "placeable" if it only fits without one, "infeasible" if it doesn't fit
+    # A private table keeps the shared one cold for the runs being timed.
+    result, cleared = search_moves(bits, [shape_key(piece) for piece in hand], table=TranspositionTable())
+    if result is None:
+        return "infeasible"
+    return "clear" if cleared else "placeable"
+
+
+def generate(rng, tier):
+    # One (board, hand) for the tier
+    while True:
+        if tier == "easy":
+            bits = play_random(rng, 0, rng.randint(2, 8))
+        elif tier == "clear":
+            bits = play_random(rng, 0, rng.randint(8, 30))
+        else:
+            bits = play_random(rng, 0, rng.randint(30, 80))
+            if bits.bit_count() < 32:
+                continue
+
+        for _ in range(20):
+            hand = random_hand(rng)
+            kind = classify(bits, hand)
+            if (tier == "easy" and kind != "infeasible" or tier == "clear" and kind == "clear"
+                    or tier == "infeasible" and kind == "infeasible" or tier == "dense" and kind != "infeasible"):
+                return to_board(bits), hand
+
+
+def generate_positions(seed, count, tiers=TIERS):
+    # count positions for each tier as (tier, board, hand). The same seed always gives the same positions.
+    rng = random.Random(seed)
+    return [(tier, *generate(rng, tier)) for tier in tiers for _ in range(count)]
+
+
+def parse_setting(text):
+    # "first", "best:budget=0.05", "lookahead:budget=0.5" or "first:table=0,warm=1" -> (name, settings dict)
+    mode, _, options = text.partition(":")
+    if mode not in MODES:
+        raise argparse.ArgumentTypeError(f"Unknown solver mode {mode!r}")
+
+    setting = {"mode": mode, "budget": None, "table": None, "warm": False, "clears": 1}
+    for option in filter(None, options.split(",")):
+        key, _, value = option.partition("=")
+        if key == "budget":
+            setting["budget"] = float(value)
+        elif key in ("table", "clears"):
+            setting[key] = int(value)
+        elif key == "warm":
+            setting["warm"] = value not in ("0", "false", "")
+        else:
+            raise argparse.ArgumentTypeError(f"Unknown setting {key!r} in {text!r}")
+    return text, setting
+
+
+def run_setting(setting, positions):
+    # Solves every position once and returns {tier: [(seconds, nodes), ...]}
+    table = TranspositionTable(setting["table"]) if setting["table"] is not None else transposition_table
+    table.clear()
+
+    runs = {}
+    for tier, board, hand in positions:
+        if not setting["warm"]:
+            table.clear()
+        start = time.perf_counter()
+        result = solve(board, hand, setting["mode"], setting["clears"], setting["budget"], table)
+        runs.setdefault(tier, []).append((time.perf_counter() - start, result["nodes"]))
+    return runs
+
+
+def peak_memory(setting, positions):
+    # Largest amount of memory one solve allocated, in bytes. Run on its own since tracing slows everything down.
+    table = TranspositionTable(setting["table"]) if setting["table"] is not None else transposition_table
+    peaks = {}
+    for tier, board, hand in positions:
+        table.clear()
+        tracemalloc.start()
+        solve(board, hand, setting["mode"], setting["clears"], setting["budget"], table)
+        peaks[tier] = max(peaks.get(tier, 0), tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    table.clear()
+    return peaks
+
+
+def percentile(values, p):
+    # Nearest rank: the smallest value with at least p% of the values at or below it
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))]
+
+
+def summarise(runs, peaks):
+    summary = {}
+    for tier, samples in runs.items():
+        seconds = [s for s, _ in samples]
+        nodes = sum(n for _, n in samples)
+        summary[tier] = {f"p{p}": percentile(seconds, p) for p in PERCENTILES}
+        summary[tier]["nodes_per_second"] = nodes / sum(seconds) if sum(seconds) else 0
+        if peaks is not None:
+            summary[tier]["peak_bytes"] = peaks[tier]
+    return summary
+
+
+def print_report(results):
+    first = next(iter(results))
+    print(f"{'setting':<28}{'tier':<12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'nodes/s':>12}{'peak KiB':>10}"
+          f"{'p50 vs ' + first[:10]:>20}")
+    for name, summary in results.items():
+        for tier, row in summary.items():
+            base = results[first][tier]["p50"]
+            ratio = f"{row['p50'] / base:.2f}x" if base else "-"
+            peak = f"{row['peak_bytes'] / 1024:.0f}" if "peak_bytes" in row else "-"
+            print(f"{name:<28}{tier:<12}{row['p50'] * 1000:>10.2f}{row['p95'] * 1000:>10.2f}"
+                  f"{row['p99'] * 1000:>10.2f}{row['nodes_per_second']:>12.0f}{peak:>10}{ratio:>20}")
+
+
+def regressions(results, baseline, threshold, min_delta):
+    # Every (setting, tier, percentile) that got more than threshold (0.1 = 10%) slower than the baseline run.
+    # Anything under min_delta seconds slower is put down to timer noise.
+    found = []
+    for name, summary in results.items():
+        for tier, row in summary.items():
+            for p in PERCENTILES:
+                old = baseline.get(name, {}).get(tier, {}).get(f"p{p}")
+                if old and row[f"p{p}"] > old * (1 + threshold) and row[f"p{p}"] - old > min_delta:
+                    found.append(f"{name} {tier} p{p}: {old * 1000:.2f} ms -> {row[f'p{p}'] * 1000:.2f} ms")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the solver on seeded positions.")
+    parser.add_argument("settings", nargs="*", type=parse_setting, default=None,
+                        help="solver settings to compare, e.g. first, first:table=0, best:budget=0.05 "
+                             "(options: budget, table, clears, warm)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--count", type=int, default=50, help="positions per tier")
+    parser.add_argument("--tiers", nargs="+", choices=TIERS, default=TIERS)
+    parser.add_argument("--no-memory", action="store_true", help="skip the (slow) peak memory pass")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file from an earlier --save to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="fail if a percentile is this much slower than the baseline (default: 0.2 = 20%%)")
+    parser.add_argument("--min-delta", type=float, default=1.0,
+                        help="ignore slowdowns smaller than this many milliseconds (default: 1)")
+    args = parser.parse_args(argv)
+
+    settings = args.settings or [parse_setting("first")]
+    positions = generate_positions(args.seed, args.count, args.tiers)
+    for piece in PIECES:
+        placements(piece)  # every setting gets the same warm placement index
+
+    results = {}
+    for name, setting in settings:
+        peaks = None if args.no_memory else peak_memory(setting, positions)
+        results[name] = summarise(run_setting(setting, positions), peaks)
+    print_report(results)
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            found = regressions(results, json.load(file), args.max_regression, args.min_delta / 1000)
+        for line in found:
+            print("Regression:", line)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# Bitboard helpers for the solver.
+# The 8x8 board is stored as one int: cell board[row][col] is bit row * 8 + col.
+from functools import lru_cache
+
+PLACEMENT_CACHE_SIZE = 1024  # distinct shapes kept in the placement index
+
+ROW_MASKS = [0xFF << (row * 8) for row in range(8)]
+COL_MASKS = [0x0101010101010101 << col for col in range(8)]
+
+BIT_COUNTS = bytes(n.bit_count() for n in range(256))
+
+
+def to_bits(board):
+    bits = 0
+    for r, row in enumerate(board):
+        for c, cell in enumerate(row):
+            if cell == 1:
+                bits |= 1 << (r * 8 + c)
+    return bits
+
+
+def to_board(bits):
+    return [[(bits >> (r * 8 + c)) & 1 for c in range(8)] for r in range(8)]
+
+
+def shape_key(block):
+    # Trimmed, hashable copy of a block, so the same shape always gives the same key no matter how it was drawn
+    cells = {(r, c) for r, row in enumerate(block) for c, cell in enumerate(row) if cell == 1}
+    if not cells:
+        return ()
+
+    top, bottom = min(r for r, _ in cells), max(r for r, _ in cells)
+    left, right = min(c for _, c in cells), max(c for _, c in cells)
+    return tuple(tuple(1 if (r, c) in cells else 0 for c in range(left, right + 1)) for r in range(top, bottom + 1))
+
+
+def block_mask(shape):
+    # Mask of the shape's cells with its top left corner at (0, 0)
+    mask = 0
+    for r, row in enumerate(shape):
+        for c, cell in enumerate(row):
+            if cell == 1:
+                mask |= 1 << (r * 8 + c)
+    return mask
+
+
+@lru_cache(maxsize=PLACEMENT_CACHE_SIZE)
+def placements(shape):
+    # Every spot the shape fits inside the board as (row, col, mask), row/col being its top left corner.
+    # Takes a shape_key so each distinct shape is only worked out once and shared by every solve.
+    if not shape:
+        return ((0, 0, 0),)  # a blank block fits anywhere without covering anything
+
+    height, width = len(shape), len(shape[0])
+    mask = block_mask(shape)
+
+    return tuple((row, col, mask << (row * 8 + col)) for row in range(9 - height) for col in range(9 - width))
+
+
+def clear_lines(bits):
+    # Folds every row onto its first column and every column onto the first row,
+    # so a bit that survives means that whole line is full.
+    rows = bits & (bits >> 1)
+    rows &= rows >> 2
+    rows &= rows >> 4
+    rows &= COL_MASKS[0]
+
+    cols = bits & (bits >> 8)
+    cols &= cols >> 16
+    cols &= cols >> 32
+    cols &= ROW_MASKS[0]
+
+    if not rows and not cols:
+        return bits, 0
+
+    full = rows * ROW_MASKS[0] | cols * COL_MASKS[0]
+    return bits & ~full, rows.bit_count() + cols.bit_count()
+
+
+def fragmentation(bits):
+    # Number of neighbouring cell pairs where one cell is filled and the other is empty
+    across = (bits ^ (bits >> 1)) & ~COL_MASKS[7]
+    down = (bits ^ (bits >> 8)) & ~ROW_MASKS[7]
+    return across.bit_count() + down.bit_count()
+
+
+def transpose(bits):
+    # (row, col) -> (col, row), by swapping bits across the diagonal in blocks of 4, 2 and 1
+    t = 0x0F0F0F0F00000000 & (bits ^ (bits << 28))
+    bits ^= t ^ (t >> 28)
+    t = 0x3333000033330000 & (bits ^ (bits << 14))
+    bits ^= t ^ (t >> 14)
+    t = 0x5500550055005500 & (bits ^ (bits << 7))
+    bits ^= t ^ (t >> 7)
+    return bits
+
+
+def row_fills(bits):
+    # Filled cells in each row, as 8 bytes
+    return bits.to_bytes(8, "little").translate(BIT_COUNTS)
+
+
+def col_fills(bits):
+    return row_fills(transpose(bits))
+
+
+def lines_within(fills, cells):
+    # Most of the lines with these filled cell counts (like row_fills gives) that `cells` more filled cells could
+    # complete, taking the fullest lines first. Once every line has been completed, each further 8 cells could
+    # complete one again.
+    count = 0
+    for filled in sorted(fills, reverse=True):
+        if 8 - filled > cells:
+            break
+        cells -= 8 - filled
+        count += 1
+    return count + cells // 8
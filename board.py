@@ -0,0 +1,77 @@
+# A bitboard that can be changed in place and changed back.
+# It keeps how many cells of every row and column are filled, so placing a block only has to look at the lines the
+# block touched to know which ones it completed. Made with undoable=True, every placement can be undone without
+# keeping copies around.
+from bitboard import ROW_MASKS, COL_MASKS
+
+
+class Board:
+    def __init__(self, bits=0, undoable=False):
+        self.bits = bits
+        self.row_counts = [(bits & mask).bit_count() for mask in ROW_MASKS]
+        self.col_counts = [(bits & mask).bit_count() for mask in COL_MASKS]
+        # (mask placed, cells it cleared) for every placement, so they can be undone. Only kept when asked for, since
+        # a board that's only ever played on would keep it growing.
+        self.history = [] if undoable else None
+
+    def count(self, mask, step):
+        # Adds step to the counts of every row and column the mask has cells in
+        while mask:
+            low = mask & -mask
+            cell = low.bit_length() - 1
+            self.row_counts[cell >> 3] += step
+            self.col_counts[cell & 7] += step
+            mask ^= low
+
+    def fits(self, mask):
+        return not self.bits & mask
+
+    def place(self, mask):
+        # Fills the mask's cells, which have to be empty, then clears the rows and columns that are now full.
+        # Returns the number of lines cleared.
+        rows = cols = 0  # the lines the mask touches, as bit sets
+        m = mask
+        while m:
+            low = m & -m
+            cell = low.bit_length() - 1
+            self.row_counts[cell >> 3] += 1
+            self.col_counts[cell & 7] += 1
+            rows |= 1 << (cell >> 3)
+            cols |= 1 << (cell & 7)
+            m ^= low
+        self.bits |= mask
+
+        full = 0
+        lines = 0
+        for line, counts, masks in ((rows, self.row_counts, ROW_MASKS), (cols, self.col_counts, COL_MASKS)):
+            while line:
+                n = (line & -line).bit_length() - 1
+                if counts[n] == 8:
+                    full |= masks[n]
+                    lines += 1
+                line &= line - 1
+
+        if full:
+            # A cell where a full row crosses a full column is only cleared once
+            self.count(full, -1)
+            self.bits &= ~full
+        if self.history is not None:
+            self.history.append((mask, full))
+        return lines
+
+    def undo(self):
+        # Takes back the last placement, cleared lines and all. Only for a board made with undoable=True.
+        mask, full = self.history.pop()
+        if full:
+            self.bits |= full
+            self.count(full, 1)
+        self.bits &= ~mask
+        self.count(mask, -1)
+
+    def remove(self, mask):
+        # Empties the mask's filled cells. That isn't a placement, so earlier placements can't be undone past it.
+        mask &= self.bits
+        self.bits &= ~mask
+        self.count(mask, -1)
+        if self.history is not None:
+            self.history.clear()
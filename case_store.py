@@ -0,0 +1,164 @@
+# Binary case store: the cases.txt format packed into fixed-size records, read through mmap.
+# After an 8 byte header every case is one 20 byte record: the board's bitboard (8 bytes) and three pieces of
+# 4 bytes each, so case n is always at the same offset and is read without touching the others.
+# A piece is its cells as a 25 bit mask (bit r * 5 + c) with its height and width above them, so a piece keeps
+# exactly the grid it was saved with, blank or not. A height of 0 means the case has no piece there.
+import argparse
+import mmap
+import os
+import struct
+
+from bitboard import to_bits, to_board
+from cases import parse_case, format_case, read_cases
+
+MAGIC = b"BBCASE\x00\x01"
+RECORD = struct.Struct("<Q3I")
+PIECES_PER_CASE = 3
+PIECE_SIZE = 5  # pieces are at most 5x5
+
+
+def pack_piece(piece):
+    height, width = len(piece), len(piece[0]) if piece else 0
+    if height > PIECE_SIZE or width > PIECE_SIZE or any(len(row) != width for row in piece):
+        raise ValueError(f"Pieces should be grids of up to {PIECE_SIZE}x{PIECE_SIZE} cells")
+
+    mask = 0
+    for r, row in enumerate(piece):
+        for c, cell in enumerate(row):
+            if cell not in (0, 1):
+                raise ValueError(f"Piece cells should be 0 or 1, got {cell}")
+            mask |= cell << (r * PIECE_SIZE + c)
+    return height << 28 | width << 25 | mask
+
+
+def unpack_piece(packed):
+    height, width = packed >> 28 & 7, packed >> 25 & 7
+    return [[packed >> (r * PIECE_SIZE + c) & 1 for c in range(width)] for r in range(height)]
+
+
+def pack_case(board, pieces):
+    if len(board) != 8 or any(len(row) != 8 for row in board) or any(cell not in (0, 1) for row in board
+                                                                      for cell in row):
+        raise ValueError("Board should be 8x8 cells of 0 or 1")
+    if len(pieces) > PIECES_PER_CASE:
+        raise ValueError(f"Cases hold at most {PIECES_PER_CASE} pieces, got {len(pieces)}")
+    packed = [pack_piece(piece) for piece in pieces] + [0] * (PIECES_PER_CASE - len(pieces))
+    return RECORD.pack(to_bits(board), *packed)
+
+
+def unpack_case(record):
+    bits, *packed = RECORD.unpack(record)
+    return to_board(bits), [unpack_piece(piece) for piece in packed if piece >> 28]
+
+
+class CaseStore:
+    # A case file opened for reading by index or in order, and for appending. Works like a list of
+    # (board, pieces): len(store), store[n] (negative n counts from the end) and iterating over it.
+    def __init__(self, path):
+        if not os.path.exists(path) or not os.path.getsize(path):
+            with open(path, "wb") as file:
+                file.write(MAGIC)
+
+        self.file = open(path, "r+b")
+        if self.file.read(len(MAGIC)) != MAGIC:
+            self.file.close()
+            raise ValueError(f"{path} isn't a case store")
+        self.map = None
+        self.count = 0
+        self.remap()
+
+    def remap(self):
+        # A partly written record at the end (from a crash mid append) is left out
+        if self.map is not None:
+            self.map.close()
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.count = (len(self.map) - len(MAGIC)) // RECORD.size
+
+    def refresh(self):
+        # Picks up cases appended through other handles (or by other processes) since the file was mapped
+        if os.fstat(self.file.fileno()).st_size != len(self.map):
+            self.remap()
+
+    def __len__(self):
+        self.refresh()
+        return self.count
+
+    def __getitem__(self, n):
+        if n < 0:
+            n += len(self)
+        if not 0 <= n < self.count:
+            self.refresh()
+            if not 0 <= n < self.count:
+                raise IndexError("case index out of range")
+        start = len(MAGIC) + n * RECORD.size
+        if start + RECORD.size > len(self.map):
+            self.remap()  # appended since the file was mapped
+        return unpack_case(self.map[start:start + RECORD.size])
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+    def append(self, board, pieces):
+        # Adds a case to the end of the file and returns its index. The end is looked up in the file itself, so cases
+        # appended through another handle (or by another process) since this one was opened are kept. A partly
+        # written record there is written over. Writers aren't locked against each other, so two appending at the
+        # same moment can still clash.
+        record = pack_case(board, pieces)
+        index = (os.fstat(self.file.fileno()).st_size - len(MAGIC)) // RECORD.size
+        self.file.seek(len(MAGIC) + index * RECORD.size)
+        self.file.write(record)
+        self.file.flush()
+        self.count = index + 1
+        return index
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def text_to_store(text_path, store_path):
+    # Appends every case in a cases.txt style file to a store, returning how many there were
+    with open(text_path) as file, CaseStore(store_path) as store:
+        count = 0
+        for number, line in read_cases(file):
+            try:
+                board, pieces = parse_case(line)
+                # Older games saved the tile editor's cursor (a 2) along with the piece
+                pieces = [[[int(cell == 1) for cell in row] for row in piece] for piece in pieces]
+                store.append(board, pieces)
+            except ValueError as e:
+                raise ValueError(f"{text_path} line {number}: {e}") from None
+            count += 1
+    return count
+
+
+def store_to_text(store_path, text_path):
+    with CaseStore(store_path) as store, open(text_path, "w") as file:
+        for board, pieces in store:
+            file.write(format_case(board, pieces) + "\n")
+        return len(store)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert cases between cases.txt and the binary case store.")
+    parser.add_argument("direction", choices=("to-store", "to-text"))
+    parser.add_argument("source")
+    parser.add_argument("destination")
+    args = parser.parse_args(argv)
+
+    if args.direction == "to-store":
+        count = text_to_store(args.source, args.destination)
+    else:
+        count = store_to_text(args.source, args.destination)
+    print(f"Converted {count} cases")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+# Reading and writing the cases.txt format: board|piece|piece|piece
+# The board is its 64 cells row by row, and each piece is its rows of cells separated by commas.
+
+
+def parse_case(line):
+    board_str, *piece_strs = line.strip().split("|")
+    if len(board_str) != 64:
+        raise ValueError(f"Board should have 64 cells, got {len(board_str)}")
+
+    board = [list(map(int, board_str[n * 8:(n + 1) * 8])) for n in range(8)]
+    pieces = [[list(map(int, row)) for row in piece.split(",")] for piece in piece_strs]
+    return board, pieces
+
+
+def format_case(board, pieces):
+    board_string = "".join("".join(map(str, row)) for row in board)
+    piece_strings = [",".join("".join(map(str, row)) for row in piece) for piece in pieces]
+    return "|".join([board_string] + piece_strings)
+
+
+def read_cases(file):
+    # Yields (line number, line) for every case in an open file, skipping blank lines
+    for number, line in enumerate(file, 1):
+        if line.strip():
+            yield number, line.strip()
@@ -0,0 +1,203 @@
+# Lookahead: picks the placement for this hand whose final board does best over the next few hands.
+# The next hands aren't known, so they're sampled from a piece distribution (Monte Carlo), and each sampled hand is
+# played greedily (play_hand). A round samples one set of future hands and plays it out from every
+# candidate board, so candidates are always compared on the same hands.
+import heapq
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from ai import OutOfTime, search_moves, iter_moves, solution_score, score_board, to_moves, log_solve
+from bitboard import to_bits, to_board, shape_key, block_mask, placements, clear_lines
+from pieces import PIECES
+
+CANDIDATES = 8  # best scoring final boards of this hand that get rolled out
+DEPTH = 3  # future hands per rollout
+ROUNDS = 64  # sets of future hands to sample, unless the time budget runs out first
+ROUNDS_PER_TASK = 4  # rounds handed to a worker at a time
+
+# Pools that rounds are played in, by number of workers. They're kept between solves, since starting the processes
+# takes longer than most lookaheads are given.
+pools = {}
+
+
+def lookahead_moves(board, tiles, time_budget=1.0, depth=DEPTH, candidates=CANDIDATES, rounds=ROUNDS, workers=None,
+                    pieces=PIECES, weights=None, seed=None):
+    # make_moves that looks past the current hand. Returns (board, moves, survival), survival being the share of
+    # sampled future hands the chosen board got through.
+    started = time.perf_counter()
+    shapes = [shape_key(tile.tile_data) for tile in tiles]
+    bits = to_bits(board)
+    result, outlook = search_lookahead(bits, shapes, time_budget, depth, candidates, rounds, workers,
+                                       pieces, weights, seed)
+    if result is None:
+        log_solve("No solution", started, None, outcome="none")
+        return None, None, None
+
+    if outlook["rounds"]:
+        message = f"Lookahead survives {outlook['survival']:.0%} of {outlook['rounds'] * depth} sampled hands"
+    else:
+        message = "Out of time before any lookahead, best scoring placement"
+    log_solve(message, started, None, outcome="lookahead", **outlook)
+    moves, _ = to_moves(bits, result[1], [block_mask(shape) for shape in shapes])
+    return to_board(result[0]), moves, outlook["survival"]
+
+
+def search_lookahead(bits, shapes, time_budget=None, depth=DEPTH, candidates=CANDIDATES, rounds=ROUNDS, workers=None,
+                     pieces=PIECES, weights=None, seed=None):
+    # lookahead_moves on a bitboard and a list of shape_keys. Returns ((final bits, ((block id, mask), ...)) or None,
+    # outlook), outlook being {"survival", "clears", "rounds"} for the chosen board: the share of future hands it got
+    # through, the lines it cleared per round on average, and how many rounds were played before time ran out.
+    # workers is the number of processes to play rounds in (one per core by default, 1 plays them here).
+    deadline = None if time_budget is None else time.time() + time_budget
+    finals = final_positions(bits, shapes, candidates, deadline)
+    if not finals:
+        return None, None
+
+    boards = [final_bits for _, (final_bits, _) in finals]
+    pieces = [shape_key(piece) for piece in pieces]
+    seeds = random.Random(seed).sample(range(1 << 30), rounds)
+
+    survived = [0] * len(boards)
+    cleared = [0] * len(boards)
+    played = 0
+    for outcome in play_rounds(boards, seeds, depth, pieces, weights, deadline, workers):
+        for n, (turns, clears) in enumerate(outcome):
+            survived[n] += turns
+            cleared[n] += clears
+        played += 1
+
+    if not played:
+        return finals[0][1], {"survival": None, "clears": None, "rounds": 0}
+
+    # Survival first, then lines cleared, then how good the board looks right now
+    best = max(range(len(boards)), key=lambda n: (survived[n], cleared[n], finals[n][0]))
+    return finals[best][1], {"survival": survived[best] / (played * depth), "clears": cleared[best] / played,
+                             "rounds": played}
+
+
+def final_positions(bits, shapes, limit, deadline=None):
+    # The `limit` best scoring distinct boards the hand can end on, as [(score, (final bits, path)), ...], best first.
+    # Stops looking (keeping what it has) at the deadline.
+    solutions = iter_moves(bits, shapes, 0, time_budget=None if deadline is None else max(deadline - time.time(), 0))
+    return [(solution_score(solution), solution[:2])
+            for solution in heapq.nlargest(limit, solutions, key=solution_score)]
+
+
+def play_hand(bits, hand, deadline=None):
+    # The playout policy: biggest piece first, each one goes wherever scores best right away. If that paints itself
+    # into a corner, any placement of the hand that fits will do. Returns (final bits or None, lines cleared).
+    placed = bits
+    clears = 0
+    for shape in sorted(hand, key=block_mask, reverse=True):
+        best = None
+        for _, _, mask in placements(shape):
+            if not placed & mask:
+                new_bits, lines = clear_lines(placed | mask)
+                score = score_board(new_bits, lines)
+                if best is None or score > best[0]:
+                    best = (score, new_bits, lines)
+        if best is None:
+            break
+        _, placed, lines = best
+        clears += lines
+    else:
+        return placed, clears
+
+    found, _ = search_moves(bits, hand, 0, time_budget=None if deadline is None else deadline - time.time())
+    if found is None:
+        return None, 0
+    clears = 0
+    for _, mask in found[1]:
+        bits, lines = clear_lines(bits | mask)
+        clears += lines
+    return bits, clears
+
+
+def play_hands(boards, hand, deadline=None):
+    # play_hand on every board, [(final bits or None, lines cleared), ...]. With numpy the greedy part is done for
+    # all the boards at once.
+    import vectorized  # numpy takes longer to import than most solves take, so only lookahead pays for it
+    if not vectorized.available:
+        return [play_hand(bits, hand, deadline) for bits in boards]
+
+    placed = vectorized.to_array(boards)
+    clears = 0
+    stuck = False
+    for shape in sorted(hand, key=block_mask, reverse=True):
+        placed, lines, fit = vectorized.best_placements(placed, shape)
+        clears += lines
+        stuck |= ~fit
+
+    return [play_hand(bits, hand, deadline) if stuck[n] else (int(placed[n]), int(clears[n]))
+            for n, bits in enumerate(boards)]
+
+
+def play_round(boards, seed, depth, pieces, weights, deadline=None):
+    # Samples depth hands with seed and plays them out from every board. Returns [(hands survived, lines cleared),
+    # ...] in the order of boards, or None if the deadline passed first.
+    rng = random.Random(seed)
+    hands = [rng.choices(pieces, weights, k=3) for _ in range(depth)]
+    boards = list(boards)
+    turns = [0] * len(boards)
+    clears = [0] * len(boards)
+    alive = list(range(len(boards)))
+    for hand in hands:
+        if not alive:
+            break
+        if deadline is not None and time.time() > deadline:
+            return None
+        try:
+            played = play_hands([boards[n] for n in alive], hand, deadline)
+        except OutOfTime:
+            return None
+
+        still = []
+        for n, (bits, lines) in zip(alive, played):
+            if bits is not None:
+                boards[n] = bits
+                turns[n] += 1
+                clears[n] += lines
+                still.append(n)
+        alive = still
+    return list(zip(turns, clears))
+
+
+def play_rounds(boards, seeds, depth, pieces, weights, deadline=None, workers=None):
+    # Yields play_round's outcome for every seed, or for as many as were played by the deadline
+    chunks = [seeds[n:n + ROUNDS_PER_TASK] for n in range(0, len(seeds), ROUNDS_PER_TASK)]
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        for chunk in chunks:
+            yield from play_chunk(boards, chunk, depth, pieces, weights, deadline)
+        return
+
+    pool = pools.get(workers)
+    if pool is None:
+        pool = pools[workers] = ProcessPoolExecutor(max_workers=workers)
+    pending = set()
+    try:
+        pending = {pool.submit(play_chunk, boards, chunk, depth, pieces, weights, deadline) for chunk in chunks}
+        while pending:
+            timeout = None if deadline is None else max(0, deadline - time.time())
+            done, pending = wait(pending, timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                break  # out of time, whatever is still being played gets dropped
+            for future in done:
+                yield from future.result()
+    finally:
+        # Rounds not started yet are dropped, the ones being played stop at the deadline
+        for future in pending:
+            future.cancel()
+
+
+def play_chunk(boards, seeds, depth, pieces, weights, deadline):
+    # Task for one worker: a few rounds, stopping at the deadline
+    outcomes = []
+    for seed in seeds:
+        outcome = play_round(boards, seed, depth, pieces, weights, deadline)
+        if outcome is None:
+            break
+        outcomes.append(outcome)
+    return outcomes
@@ -1,6 +1,20 @@
+import logging
+import os
+
 import pygame
 from tile import Selection
 from ai import *
+from bitboard import to_bits, to_board, shape_key, clear_lines
+from board import Board
+from case_store import CaseStore, text_to_store
+from background import BackgroundSolver
+
+log = logging.getLogger(__name__)
+
+FPS = 60  # frame rate cap while something is going on
+PLACE_DELAY = 250  # ms after placing a tile before clicks draw on the board again
+CASES_TEXT = "cases.txt"
+CASES_STORE = "cases.bin"
 
 
 class Game:
@@ -8,6 +22,7 @@ class Game:
         pygame.init()
 
         self.board = [[0 for j in range(8)] for i in range(8)]
+        self.bitboard = Board()  # the same cells, with the row / column fill counts that tell which lines are full
         # blue-blank, red-block color, green-where to place tile
         self.colors = {
             0: (33, 44, 82),
@@ -50,27 +65,56 @@ class Game:
         self.clicked_2 = False  # right mouse button
         self.try_to_solve = True  # used to make sure the algorithm doesn't run over and over again
 
-        self.place_timer = 0  # prevents the user from placing a block right after a tile was placed
+        self.place_timer = 0  # prevents the user from placing a block right after a tile was placed (ticks it runs out)
+        self.board_dirty = False  # the board changed since the last frame was drawn
 
         self.solved_board = None
+        self.solutions = []  # (board, overlay) of every solution of the position found so far, tab cycles them
+        self.shown = 0  # the one on screen
+        self.all_found = False  # no more solutions to ask the solver for
+        self.finding_more = False
+        self.solver = BackgroundSolver()  # searches in a worker process so the window never freezes
+        self.cases = open_case_store()
 
-        self.visual_overlay = []
+        self.moves = []  # the solution on screen
+        self.solution_hand = []  # shape_keys of the hand the solutions are for, which the moves' pieces index
+        self.visual_overlay = []  # the moves drawn over the board, None until the board is next drawn
 
         self.font = pygame.font.SysFont('arial', 30)
+        self.solving_text = self.font.render("Solving...", True, (255, 255, 255))
+
+        # Rendering cache: the board is drawn onto its own surface only when a cell or the overlay changes, and
+        # every frame is a list of layers (surface, position, version). Only the parts of the window where a layer
+        # appeared, moved, changed or went away get redrawn and pushed to the display.
+        self.board_surface = pygame.Surface((self.board_length, self.board_length))
+        self.board_key = None
+        self.board_version = 0
+        self.layers = []
+        self.drawn_layers = None  # last frame's layers, None when the whole window needs redrawing
 
     def main(self):
+        clock = pygame.time.Clock()
+        quiet = False
         while 1:
-            for event in pygame.event.get():
+            # Nothing moves on screen by itself unless a solve is running, so after a frame that changed nothing
+            # sleep until the next input event
+            if quiet and not self.solver.solving:
+                events = [pygame.event.wait()] + pygame.event.get()
+            else:
+                events = pygame.event.get()
+
+            for event in events:
                 if event.type == pygame.QUIT:
+                    self.solver.close()
+                    self.cases.close()
                     quit()
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_s:
                         self.save_edge_case()
-
-            keys = pygame.key.get_pressed()
-            for i in range(10):
-                if keys[pygame.K_0 + i]:
-                    self.load_edge_case(i)
+                    elif event.key == pygame.K_TAB:
+                        self.next_solution()
+                    elif pygame.K_0 <= event.key <= pygame.K_9:
+                        self.load_edge_case(event.key - pygame.K_0)
 
             mouse = pygame.mouse.get_pos()
             self.mouse_hitbox.x, self.mouse_hitbox.y = mouse[0], mouse[1]
@@ -79,23 +123,24 @@ class Game:
 
             self.clicked, self.clicked_2 = clicks[0], clicks[2]
 
-            if self.visual_overlay and all(self.blanks):
-                self.visual_overlay.clear()
+            if self.moves and all(self.blanks):
+                self.show_moves([])
 
             if not any(self.blanks) and self.try_to_solve:  # when three tiles have been created
-                print("Trying to solve")
-                solution = make_moves(self.board, self.selections)
-                if solution[0] is not None:
-                    self.solved_board, self.visual_overlay = solution
+                log.info("Trying to solve")
+                self.solver.submit(self.board, [s.tile_data for s in self.selections])
                 self.try_to_solve = False
 
-            self.draw_screen()
+            self.collect_solution()
+
+            creating_tile = self.creating_tile
+            quiet = not self.draw_screen() and creating_tile == self.creating_tile
 
             if self.clicked and self.selected_tile_row is not None and not self.creating_tile:
-                replace = add_tile(self.board, self.selected_tile.tile_data, self.selected_tile_row,
-                                   self.selected_tile_col, is_human=True)
-                if replace[0]:
-                    self.place_timer = 100  # starts the place timer
+                if self.place_tile(self.selected_tile.tile_data, self.selected_tile_row - 1,
+                                   self.selected_tile_col - 1):
+                    self.position_changed()
+                    self.place_timer = pygame.time.get_ticks() + PLACE_DELAY  # starts the place timer
                     self.reset_hand()
                     # refreshes the selection
                     self.selections[self.selected_tile_index] = Selection(self.selection_x,
@@ -105,95 +150,86 @@ class Game:
                                                                           self.selection_length, self.tile_size)
                     self.selected_tile_index = None
 
-            if self.place_timer != 0:
-                self.place_timer -= 1
-            self.board = check_clear(self.board)[0]
+            if self.board_dirty:
+                self.board_dirty = False
+                quiet = False  # draw the change before waiting for input again
+            clock.tick(FPS)
 
     def draw_screen(self):
+        # Returns whether anything on the main screen changed
         if not self.creating_tile:
+            self.layers = []
             self.draw_board()
             self.update_tiles()
             if self.selected_tile is not None:
-                self.screen.blit(
+                self.layers.append((
                     self.selected_tile.hover_surface(self.tile_size - (self.tile_size / 12) + 5, (200, 49, 49)),
-                    (self.mouse_hitbox[0], self.mouse_hitbox[1]))
+                    (self.mouse_hitbox[0], self.mouse_hitbox[1]), 0))
+            if self.solver.solving:
+                self.layers.append((self.solving_text,
+                                    (self.board_pos, (self.board_pos - self.solving_text.get_height()) / 2), 0))
+            return self.update_layers()
         else:
             self.clicked_tile.draw_selection_screen(self.screen)
             self.creating_tile = self.clicked_tile.clicked_on
-        pygame.display.update()
+            self.drawn_layers = None  # the tile screen covered everything
+            pygame.display.update()
+            return False
+
+    def update_layers(self):
+        # Keyed on the surfaces themselves, which keeps last frame's alive so a new one can't be mistaken for them
+        layers = {(surface, tuple(pos), version): surface.get_rect(topleft=pos) for surface, pos, version in self.layers}
+        if self.drawn_layers is None:
+            dirty = [self.screen.get_rect()]
+        else:
+            dirty = [rect for key, rect in self.drawn_layers.items() if key not in layers]
+            dirty += [rect for key, rect in layers.items() if key not in self.drawn_layers]
+        self.drawn_layers = layers
+
+        for rect in dirty:
+            self.screen.set_clip(rect)
+            self.screen.fill((66, 93, 159))
+            for surface, pos, _ in self.layers:
+                self.screen.blit(surface, pos)
+        self.screen.set_clip(None)
+        if dirty:
+            pygame.display.update(dirty)
+        return bool(dirty)
 
     def save_edge_case(self):
-        with open("cases.txt", "a+") as c:
-            board_string = ""
-            for row in self.board:
-                row_string = "".join(map(str, row))
-                board_string += row_string
-
-            board_string += "|"
-
-            for s in self.selections:
-                data = s.tile_data
-                for row in data:
-                    row_string = "".join(map(str, row))
-                    board_string += row_string + ","
-
-                board_string = board_string[:-1]
-                board_string += "|"
-
-            board_string = board_string[:-1]
-            c.write(board_string + "\n")
-
-            c.seek(0)
-            print(f"Saved to line: {len(c.readlines())}")
+        # The tile editor marks the cell under the cursor with a 2, which isn't part of the piece
+        pieces = [[[int(cell == 1) for cell in row] for row in s.tile_data] for s in self.selections]
+        try:
+            number = self.cases.append(self.board, pieces)
+        except ValueError as e:
+            print(f"Couldn't save the case: {e}")
+            return
+        print(f"Saved to line: {number + 1}")
 
     def load_edge_case(self, line):
         try:
-            with open("cases.txt", "r") as c:
-                cases = c.readlines()
-                data_str = cases[line - 1].strip().split("|")
-                board_str = data_str[0]
-                selection_list = data_str[1:]
-                self.board.clear()
-                for n in range(8):
-                    self.board.append(list(map(int, list(board_str[n * 8:(n + 1) * 8]))))
-                self.selections.clear()
-                for n, i in enumerate(selection_list):
-                    new_selection = Selection(self.selection_x,
-                                              self.board_pos + n * (
-                                                      (self.board_length - self.selection_length * 3) / 2 +
-                                                      self.selection_length), self.selection_length,
-                                              self.tile_size, tile_data=[list(map(int, list(j))) for j in i.split(",")])
-                    self.selections.append(new_selection)
-
-                if not any(self.blanks):
-                    self.try_to_solve = True
-
-                self.visual_overlay.clear()
-
+            board, pieces = self.cases[line - 1]
         except IndexError:
             print("No case saved to that slot")
+            return
+
+        self.bitboard = Board(clear_lines(to_bits(board))[0])
+        self.sync_board()
+        self.selections.clear()
+        for n, tile_data in enumerate(pieces):
+            new_selection = Selection(self.selection_x,
+                                      self.board_pos + n * (
+                                              (self.board_length - self.selection_length * 3) / 2 +
+                                              self.selection_length), self.selection_length,
+                                      self.tile_size, tile_data=tile_data)
+            self.selections.append(new_selection)
+
+        self.position_changed()
+        self.show_moves([])
 
     def draw_board(self):
-
-        self.screen.fill((66, 93, 159))
-
-        board_surf = pygame.Surface((self.board_length, self.board_length))
-        board_surf.fill((66, 93, 159))
-        pygame.draw.rect(board_surf, (24, 36, 74), (0, 0, self.board_length, self.board_length))
-
-        side_length = self.tile_size - (self.tile_size / 12)
-
-        for i, row in enumerate(self.board):
-            for j, col in enumerate(row):
-                pygame.draw.rect(board_surf, (self.colors[col]),
-                                 (i * self.tile_size + 5, j * self.tile_size + 5, side_length, side_length),
-                                 border_radius=4)
-                if self.visual_overlay and sum(self.visual_overlay[i][j]) != 0 and col != 1:
-                    pygame.draw.rect(board_surf, (self.visual_overlay[i][j]),
-                                     (i * self.tile_size + 5, j * self.tile_size + 5, side_length, side_length),
-                                     border_radius=4)
-
-        self.screen.blit(board_surf, (self.board_pos, self.board_pos))
+        self.update_board_surface()
+        self.layers.append((self.board_surface, (self.board_pos, self.board_pos), self.board_version))
 
         if self.board_pos < self.mouse_hitbox[0] < self.board_pos + self.board_length - 5 and self.board_pos < \
                 self.mouse_hitbox[0] < self.board_pos + self.board_length - 5:
@@ -207,15 +243,74 @@ class Game:
                     pos_x = row * self.tile_size
                     pos_y = col * self.tile_size
 
-                    self.screen.blit(
+                    self.layers.append((
                         self.selected_tile.hover_surface(self.tile_size - (self.tile_size / 12) + 5, (100, 0, 0)),
-                        (pos_x, pos_y))
+                        (pos_x, pos_y), 0))
             elif 0 < row < 9 and 0 < col < 9:
                 # manually draw on board
-                if self.clicked and self.selected_tile is None and self.place_timer == 0:
-                    self.board[row - 1][col - 1] = 1
+                if self.clicked and self.selected_tile is None and \
+                        pygame.time.get_ticks() >= self.place_timer:
+                    self.set_cell(row - 1, col - 1, 1)
                 elif self.clicked_2:
-                    self.board[row - 1][col - 1] = 0
+                    self.set_cell(row - 1, col - 1, 0)
+
+    def update_board_surface(self):
+        # Redraws the board surface if a cell or the overlay changed since it was last drawn
+        if self.visual_overlay is None:
+            self.visual_overlay = build_overlay(move_masks(self.moves, self.solution_hand)) if self.moves else []
+        key = (tuple(map(tuple, self.board)), tuple(tuple(map(tuple, row)) for row in self.visual_overlay or ()))
+        if key == self.board_key:
+            return
+        self.board_key = key
+        self.board_version += 1
+
+        board_surf = self.board_surface
+        board_surf.fill((66, 93, 159))
+        pygame.draw.rect(board_surf, (24, 36, 74), (0, 0, self.board_length, self.board_length))
+
+        side_length = self.tile_size - (self.tile_size / 12)
+
+        for i, row in enumerate(self.board):
+            for j, col in enumerate(row):
+                pygame.draw.rect(board_surf, (self.colors[col]),
+                                 (i * self.tile_size + 5, j * self.tile_size + 5, side_length, side_length),
+                                 border_radius=4)
+                if self.visual_overlay and sum(self.visual_overlay[i][j]) != 0 and col != 1:
+                    pygame.draw.rect(board_surf, (self.visual_overlay[i][j]),
+                                     (i * self.tile_size + 5, j * self.tile_size + 5, side_length, side_length),
+                                     border_radius=4)
+
+    def set_cell(self, row, col, value):
+        if self.board[row][col] != value:
+            cell = 1 << (row * 8 + col)
+            if value:
+                self.bitboard.place(cell)
+            else:
+                self.bitboard.remove(cell)
+            self.sync_board()
+            self.position_changed()
+
+    def place_tile(self, tile_data, row, col):
+        # Places a tile with its top left corner on board[row][col] and clears the lines it fills.
+        # Returns False, leaving the board alone, if it doesn't fit there.
+        mask = 0
+        for n1, i in enumerate(tile_data):
+            for n2, j in enumerate(i):
+                if not (0 <= row + n1 < 8 and 0 <= col + n2 < 8):
+                    return False  # Out of bounds
+                if j == 1:
+                    mask |= 1 << ((row + n1) * 8 + col + n2)
+        if not self.bitboard.fits(mask):
+            return False  # Overlapping another tile
+
+        self.bitboard.place(mask)
+        self.sync_board()
+        return True
+
+    def sync_board(self):
+        # Copies the bitboard to the cell lists the rest of the game reads. In place, so every reference to
+        # self.board sees it.
+        self.board[:] = to_board(self.bitboard.bits)
 
     def update_tiles(self):
         # 'i' is the three plus signs on the side of the screen
@@ -229,7 +324,7 @@ class Game:
                     self.creating_tile = True  # changes the screen
                     self.clicked_tile = i
                     self.clicked_tile.clicked_on = True
-                    self.try_to_solve = True  # tells the program a block has been changed, so it can try solving again
+                    self.position_changed()  # tells the program a block has been changed, so it can try solving again
                 elif self.clicked:
                     self.selected_tile = i
                     self.selected_tile_index = n
@@ -241,7 +336,65 @@ class Game:
 
         for n, tile in enumerate(self.selections):
             t_surf = tile.draw_selection()
-            self.screen.blit(t_surf, (tile.x, tile.y))
+            self.layers.append((t_surf, (tile.x, tile.y), tile.version))
+
+    def position_changed(self):
+        # The board or a tile changed, so any solve in progress is out of date. Solve again once all three
+        # tiles are there.
+        self.solver.cancel()
+        self.try_to_solve = True
+        self.board_dirty = True
+        self.solutions = []
+        self.finding_more = False
+
+    def collect_solution(self):
+        # Picks up the background solve's answer if it's ready
+        done = self.solver.poll()
+        if done is None:
+            return
+        solution, cleared, seconds = done
+        if self.finding_more:
+            self.finding_more = False
+            if solution is None:
+                log.info("No more solutions, back to the first")
+                self.all_found = True
+                self.show_solution(0)
+            else:
+                log.info("Found solution %d in %.4fs", len(self.solutions) + 1, seconds)
+                self.solutions.append(solution)
+                self.show_solution(len(self.solutions) - 1)
+            return
+        if solution is None:
+            log.info("No solution in %.4fs", seconds)
+            self.show_moves([])
+            return
+        if not cleared:
+            log.info("No solution with required clears found. Falling back to non-clearing solution")
+        log.info("Solved in %.4fs", seconds)
+        self.solutions = [solution]
+        self.solution_hand = [shape_key(s.tile_data) for s in self.selections]
+        self.all_found = False
+        self.show_solution(0)
+
+    def next_solution(self):
+        # Shows another solution of the position: the next one already found, a new one from the solver, or the
+        # first again once it has run out
+        if not self.solutions or self.solver.solving:
+            return
+        if self.shown + 1 < len(self.solutions) or self.all_found:
+            self.show_solution((self.shown + 1) % len(self.solutions))
+        else:
+            self.finding_more = True
+            self.solver.more()
+
+    def show_solution(self, n):
+        self.shown = n
+        self.solved_board, moves = self.solutions[n]
+        self.show_moves(moves)
+
+    def show_moves(self, moves):
+        self.moves = moves
+        self.visual_overlay = None  # built when the board is drawn
 
     def reset_hand(self):
         self.selected_tile = None
@@ -249,17 +402,20 @@ class Game:
         self.selected_tile_col = None
 
 
-def remove_blank_lines():
-    with open("cases.txt", 'r') as file:
-        lines = file.readlines()
-
-    with open("cases.txt", 'w') as file:
-        for line in lines:
-            if line.strip():
-                file.write(line)
+def open_case_store():
+    # Saved cases live in cases.bin. The first time the game runs without one, it starts with the cases in cases.txt.
+    if not os.path.exists(CASES_STORE) and os.path.exists(CASES_TEXT):
+        # Converted into a temporary file that only becomes cases.bin once every case is in, so a conversion that
+        # fails part way doesn't leave a store that's missing cases
+        temp = CASES_STORE + ".tmp"
+        if os.path.exists(temp):
+            os.remove(temp)
+        text_to_store(CASES_TEXT, temp)
+        os.replace(temp, CASES_STORE)
+    return CaseStore(CASES_STORE)
 
 
 if __name__ == "__main__":
-    remove_blank_lines()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     game = Game()
     game.main()
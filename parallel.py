@@ -0,0 +1,203 @@
+# Splitting one search over a pool of processes, for the hands that keep a single core busy for a long time.
+# The root of the search (which block goes first and where it goes) is cut into work items that the workers search
+# the rest of. Two things travel between them through shared memory: the number of the search they should be working
+# on, which moves on as soon as one item has a solution with the clears needed (or the caller gives up) so the rest
+# stop at their next check, and for best the best score found so far, which every worker prunes against.
+import multiprocessing
+import multiprocessing.util
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from ai import OutOfTime, Cancelled, CLEAR_SCORE, search_moves, search_best_moves, fill_planes, fill_score
+from bitboard import block_mask, placements, clear_lines, row_fills, col_fills
+
+POLL = 0.05  # seconds between checks of cancel() while waiting on the workers
+NO_SCORE = -(1 << 62)
+
+# The workers' views of the shared memory
+current = None  # number of the search being run
+best = None  # (search number, best score found for it)
+best_lock = None
+
+
+def start_worker(shared_current, shared_best, lock):
+    global current, best, best_lock
+    current, best, best_lock = shared_current, shared_best, lock
+
+
+class SharedBound:
+    # The best score any worker has found for search `number`, for search_best_moves' shared. A worker searches the
+    # position after a root placement that cleared some lines, so its scores are offset by what those lines are worth.
+    def __init__(self, number, offset):
+        self.number = number
+        self.offset = offset
+
+    def get(self):
+        with best_lock:
+            if best[0] != self.number or best[1] == NO_SCORE:
+                return None
+            return best[1] - self.offset
+
+    def offer(self, score):
+        with best_lock:
+            if best[0] == self.number and score + self.offset > best[1]:
+                best[1] = score + self.offset
+
+
+def root_items(bits, shapes):
+    # The search's root as work items, (block id, mask, shapes left) for every distinct block that can go first and
+    # every spot it fits. Spots that clear lines come first, then the ones going into the fullest lines.
+    block_ids = [block_mask(shape) for shape in shapes]
+    planes = fill_planes(row_fills(bits), col_fills(bits), sum(block_id.bit_count() for block_id in block_ids))
+    ranked = []
+    for n, (block_id, shape) in enumerate(zip(block_ids, shapes)):
+        if block_id in block_ids[:n]:
+            continue  # same block as one already split up
+        rest = shapes[:n] + shapes[n + 1:]
+        for _, _, mask in placements(shape):
+            if not bits & mask:
+                ranked.append((clear_lines(bits | mask)[1], fill_score(mask, planes), (block_id, mask, rest)))
+    ranked.sort(key=lambda item: item[:2], reverse=True)
+    return [item for _, _, item in ranked]
+
+
+def search_item(number, bits, block_id, mask, shapes, required_clear_count, deadline):
+    # Runs in a worker: search_moves for what's left after the block goes on mask. Returns (cleared, result) with the
+    # placement at the front of the path, or None if the search was stopped or ran out of time.
+    if current.value != number:
+        return None
+    new_bits, clears = clear_lines(bits | mask)
+    try:
+        found, cleared = search_moves(new_bits, shapes, max(required_clear_count - clears, 0),
+                                      time_budget=None if deadline is None else deadline - time.time(),
+                                      cancel=lambda: current.value != number)
+    except OutOfTime:
+        return None
+    return cleared, None if found is None else (found[0], ((block_id, mask),) + found[1])
+
+
+def best_item(number, bits, block_id, mask, shapes, deadline):
+    # Runs in a worker: search_best_moves for what's left after the block goes on mask, pruning against the best
+    # score of every worker. Returns (result, score, optimal) like it, or None if the search was over before it
+    # started.
+    if current.value != number:
+        return None
+    new_bits, clears = clear_lines(bits | mask)
+    shared = SharedBound(number, clears * CLEAR_SCORE)
+    found, score, optimal = search_best_moves(new_bits, shapes, None if deadline is None else deadline - time.time(),
+                                              shared=shared, cancel=lambda: current.value != number)
+    if found is None:
+        return None, None, optimal
+    return (found[0], ((block_id, mask),) + found[1]), score + shared.offset, optimal
+
+
+class ParallelSearch:
+    # search_moves and search_best_moves split over a pool of processes (one per core by default). The pool is kept
+    # between searches, since starting the processes takes far longer than most searches.
+    def __init__(self, workers=None):
+        # Spawned rather than forked: the process making the pool can already be running other threads (the game's
+        # solver process is a pool worker itself), and a forked child gets any lock those threads held stuck locked
+        context = multiprocessing.get_context("spawn")
+        self.current = context.RawValue("q", 0)
+        self.best = context.RawArray("q", 2)
+        self.lock = context.Lock()
+        self.pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=context,
+                                        initializer=start_worker, initargs=(self.current, self.best, self.lock))
+        # A process exiting waits for its children, so a pool left open (like the one the game's solver process keeps)
+        # is shut down first, and before the pool's own queues are closed (their finalizers run at priority 10)
+        multiprocessing.util.Finalize(self, shut_down, (self.pool, self.current), exitpriority=20)
+
+    def search_moves(self, bits, shapes, required_clear_count=1, time_budget=None, cancel=None):
+        # ai.search_moves, and it returns and raises the same. The first item to come back with the required clears
+        # wins, the no-clear fallback only once every item has come back without them.
+        deadline = None if time_budget is None else time.time() + time_budget
+        items = root_items(bits, shapes)
+        if not items:
+            return search_moves(bits, shapes, required_clear_count, time_budget=time_budget, cancel=cancel)
+
+        number = self.start()
+        futures = [self.pool.submit(search_item, number, bits, block_id, mask, rest, required_clear_count, deadline)
+                   for block_id, mask, rest in items]
+        fallback = None
+        finished = 0
+        try:
+            for outcome in self.outcomes(futures, deadline, cancel):
+                if outcome is None:
+                    continue
+                finished += 1
+                cleared, result = outcome
+                if cleared and result is not None:
+                    return result, True
+                if fallback is None:
+                    fallback = result
+        finally:
+            self.stop(futures)
+        if finished < len(futures):
+            raise OutOfTime
+        return fallback, False
+
+    def search_best_moves(self, bits, shapes, time_budget=None):
+        # ai.search_best_moves, returning the same. optimal is only True if every item was searched to the end.
+        deadline = None if time_budget is None else time.time() + time_budget
+        items = root_items(bits, shapes)
+        if not items:
+            return search_best_moves(bits, shapes, time_budget)
+
+        number = self.start()
+        futures = [self.pool.submit(best_item, number, bits, block_id, mask, rest, deadline)
+                   for block_id, mask, rest in items]
+        best = None
+        best_score = None
+        finished = 0
+        try:
+            for outcome in self.outcomes(futures, deadline):
+                if outcome is None:
+                    continue
+                result, score, optimal = outcome
+                finished += optimal
+                if result is not None and (best_score is None or score > best_score):
+                    best, best_score = result, score
+        finally:
+            self.stop(futures)
+        return best, best_score, finished == len(futures)
+
+    def start(self):
+        # Number for a new search, with no best score yet
+        number = self.current.value
+        with self.lock:
+            self.best[0], self.best[1] = number, NO_SCORE
+        return number
+
+    def stop(self, futures):
+        # Workers still on the search give up at their next check, and items not started yet never are
+        self.current.value += 1
+        for future in futures:
+            future.cancel()
+
+    def outcomes(self, futures, deadline=None, cancel=None):
+        # Yields the items' outcomes as they finish, stopping at the deadline. Raises Cancelled as soon as cancel(),
+        # an optional callable, returns True.
+        pending = set(futures)
+        while pending:
+            timeout = None if cancel is None else POLL
+            if deadline is not None:
+                left = max(0, deadline - time.time())
+                timeout = left if timeout is None else min(timeout, left)
+            done, pending = wait(pending, timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+            if cancel is not None and cancel():
+                raise Cancelled
+            if deadline is not None and time.time() >= deadline:
+                return
+
+    def close(self):
+        self.current.value += 1
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shut_down(pool, current):
+    # Stops whatever the pool is searching and waits for its processes to exit
+    current.value += 1
+    pool.shutdown(cancel_futures=True)
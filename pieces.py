@@ -0,0 +1,47 @@
+# The standard Block Blast pieces and random hands dealt from them.
+from bitboard import shape_key
+
+
+def rotate(shape):
+    # Quarter turn clockwise
+    return tuple(zip(*shape[::-1]))
+
+
+def flip(shape):
+    return tuple(row[::-1] for row in shape)
+
+
+def orientations(shape, mirror=True):
+    # Every distinct way the shape can be turned (and flipped if mirror is True)
+    found = []
+    for base in (shape, flip(shape)) if mirror else (shape,):
+        for _ in range(4):
+            base = rotate(base)
+            key = shape_key(base)
+            if key not in found:
+                found.append(key)
+    return found
+
+
+BASE_PIECES = [
+    ((1,),),
+    ((1, 1),),
+    ((1, 1, 1),),
+    ((1, 1, 1, 1),),
+    ((1, 1, 1, 1, 1),),
+    ((1, 1), (1, 1)),
+    ((1, 1, 1), (1, 1, 1)),
+    ((1, 1, 1), (1, 1, 1), (1, 1, 1)),
+    ((1, 0), (1, 1)),  # small corner
+    ((1, 0), (1, 0), (1, 1)),  # L
+    ((1, 0, 0), (1, 0, 0), (1, 1, 1)),  # big corner
+    ((1, 1, 1), (0, 1, 0)),  # T
+    ((0, 1, 1), (1, 1, 0)),  # S
+]
+
+PIECES = [piece for base in BASE_PIECES for piece in orientations(base)]
+
+
+def random_hand(rng, pieces=PIECES, weights=None, size=3):
+    # Deals size pieces (as lists of rows) using rng, a random.Random
+    return [[list(row) for row in piece] for piece in rng.choices(pieces, weights, k=size)]
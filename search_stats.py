@@ -0,0 +1,101 @@
+# Opt-in instrumentation for the solver's searches.
+import cProfile
+import io
+import json
+import pstats
+import time
+
+ANCHORS = 81  # row/col anchors the old 9x9 scan tried for every block
+
+
+class SearchStats:
+    # Counters for one search. Pass one to search_moves / search_best_moves (or make_moves, best_moves, solve)
+    # and it gets filled in as the search runs. With detail=False only the node count is kept, which costs nothing.
+    def __init__(self, detail=True, profile=False, on_node=None):
+        self.detail = detail
+        self.nodes = 0  # positions searched
+        self.depth_nodes = []  # positions searched at each depth (number of blocks placed so far)
+        self.rejected_bounds = 0  # anchors that would put a block off the board (the placement index skips them)
+        self.rejected_overlap = 0  # spots that would overlap a filled cell
+        self.clear_checks = 0  # placements checked for full lines
+        self.pruned = 0  # best_moves branches cut by the score bound
+        self.table_hits = 0  # positions answered by the transposition table (or best_moves' seen set)
+        self.table_misses = 0
+        self.placement_hits = 0  # shapes whose spots were already in the placement index
+        self.placement_misses = 0
+        self.phase_seconds = {}  # time spent in each pass: "clear" and "fallback" for make_moves, "best" for best_moves
+        self.first_block_seconds = {}  # time spent with each block placed first, keyed by its rows ("11,11")
+
+        self.on_node = on_node  # called as on_node(depth, bits, blocks_left) for every position searched
+        self.profiler = cProfile.Profile() if profile else None
+        self.names = {}
+
+    def begin(self, shapes, before, after):
+        # Called as a detailed search starts, with its (block id, shape) pairs and the placement index's
+        # cache_info() from before and after its spots were looked up
+        depth = len(shapes) + 1
+        self.depth_nodes.extend([0] * (depth - len(self.depth_nodes)))
+        self.names = dict(shapes)
+        self.placement_hits += after.hits - before.hits
+        self.placement_misses += after.misses - before.misses
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    def end(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+
+    def node(self, depth, bits, blocks_left):
+        self.depth_nodes[depth] += 1
+        if self.on_node is not None:
+            self.on_node(depth, bits, blocks_left)
+
+    def block_tried(self, depth, block_id, spots, fits, checks, started):
+        # One block tried at a position: it has `spots` in-bounds spots, `fits` of them don't overlap a filled cell
+        # and `checks` of those were placed and checked for full lines
+        self.rejected_bounds += ANCHORS - spots
+        self.rejected_overlap += spots - fits
+        self.clear_checks += checks
+        if depth == 0:
+            name = self.names[block_id]
+            if not isinstance(name, str):
+                name = self.names[block_id] = ",".join("".join(map(str, row)) for row in name)
+            self.first_block_seconds[name] = self.first_block_seconds.get(name, 0) + time.perf_counter() - started
+
+    def phase(self, name, started):
+        self.phase_seconds[name] = self.phase_seconds.get(name, 0) + time.perf_counter() - started
+
+    def table_hit_rate(self):
+        lookups = self.table_hits + self.table_misses
+        return self.table_hits / lookups if lookups else 0
+
+    def placement_hit_rate(self):
+        lookups = self.placement_hits + self.placement_misses
+        return self.placement_hits / lookups if lookups else 0
+
+    def profile_report(self, limit=20):
+        # The profiled search's most expensive functions, or "" if profiling is off
+        if self.profiler is None:
+            return ""
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+    def as_dict(self):
+        return {
+            "nodes": self.nodes,
+            "depth_nodes": self.depth_nodes,
+            "rejected_bounds": self.rejected_bounds,
+            "rejected_overlap": self.rejected_overlap,
+            "clear_checks": self.clear_checks,
+            "pruned": self.pruned,
+            "table_hits": self.table_hits,
+            "table_misses": self.table_misses,
+            "table_hit_rate": self.table_hit_rate(),
+            "placement_hit_rate": self.placement_hit_rate(),
+            "phase_seconds": self.phase_seconds,
+            "first_block_seconds": self.first_block_seconds,
+        }
+
+    def __str__(self):
+        return " ".join(f"{key}={json.dumps(value, separators=(',', ':'))}" for key, value in self.as_dict().items())
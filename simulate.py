@@ -0,0 +1,133 @@
+# Headless self-play: deals seeded random hands, lets the solver place them and keeps going until a hand doesn't
+# fit. Runs many games across processes and reports throughput, how long games last and how they score.
+# It's the load generator for the solver and the way to check a solver change actually plays better.
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bench import percentile
+from bitboard import to_board, shape_key, block_mask, clear_lines
+from pieces import random_hand
+from solver import MODES, solve
+
+MAX_TURNS = 500  # hands dealt before a game counts as survived
+LINE_POINTS = 10  # a game scores a point per cell placed and this much per line cleared
+
+
+def play_game(seed, mode="first", time_budget=None, required_clear_count=1, max_turns=MAX_TURNS):
+    # Plays one game from an empty board. The seed decides every hand, so a game can always be replayed.
+    rng = random.Random(seed)
+    bits = 0
+    turns = moves = cells = lines = 0
+    solve_seconds = 0
+    started = time.perf_counter()
+    while turns < max_turns:
+        hand = random_hand(rng)
+        result = solve(to_board(bits), hand, mode, required_clear_count, time_budget, workers=1)
+        solve_seconds += result["seconds"]
+        if not result["solved"]:
+            break
+
+        for move in result["moves"]:
+            mask = block_mask(shape_key(hand[move["piece"]])) << (move["row"] * 8 + move["col"])
+            if bits & mask:
+                raise RuntimeError(f"Game {seed} turn {turns}: the solver placed a piece on filled cells")
+            bits, cleared = clear_lines(bits | mask)
+            moves += 1
+            cells += mask.bit_count()
+            lines += cleared
+        turns += 1
+
+    return {
+        "seed": seed,
+        "turns": turns,
+        "moves": moves,
+        "lines": lines,
+        "score": cells + lines * LINE_POINTS,
+        "survived": turns == max_turns,
+        "seconds": time.perf_counter() - started,
+        "solve_seconds": solve_seconds,
+    }
+
+
+def play_games(seeds, workers=None, **settings):
+    # Yields play_game's result for every seed, in order, playing them across workers processes (one per core by
+    # default)
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        for seed in seeds:
+            yield play_game(seed, **settings)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(play_game, seed, **settings) for seed in seeds]
+        for future in futures:
+            yield future.result()
+
+
+def summarise(games, seconds):
+    turns = [game["turns"] for game in games]
+    scores = [game["score"] for game in games]
+    moves = sum(game["moves"] for game in games)
+    return {
+        "games": len(games),
+        "seconds": seconds,
+        "games_per_second": len(games) / seconds,
+        "moves_per_second": moves / seconds,
+        "solve_ms_per_move": 1000 * sum(game["solve_seconds"] for game in games) / moves if moves else 0,
+        "mean_turns": sum(turns) / len(games),
+        "survived": sum(game["survived"] for game in games),
+        "turns": {f"p{p}": percentile(turns, p) for p in (10, 50, 90)},
+        "scores": {"mean": sum(scores) / len(games), "min": min(scores),
+                   **{f"p{p}": percentile(scores, p) for p in (10, 50, 90)}, "max": max(scores)},
+        "lines": sum(game["lines"] for game in games),
+    }
+
+
+def print_report(summary):
+    print(f"{summary['games']} games in {summary['seconds']:.2f}s: {summary['games_per_second']:.2f} games/s, "
+          f"{summary['moves_per_second']:.0f} moves/s, {summary['solve_ms_per_move']:.3f} ms solving per move")
+    turns, scores = summary["turns"], summary["scores"]
+    print(f"hands survived: mean {summary['mean_turns']:.1f}, p10 {turns['p10']}, p50 {turns['p50']}, "
+          f"p90 {turns['p90']} ({summary['survived']} games hit the turn limit)")
+    print(f"scores: mean {scores['mean']:.0f}, min {scores['min']}, p10 {scores['p10']}, p50 {scores['p50']}, "
+          f"p90 {scores['p90']}, max {scores['max']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play seeded games with the solver and report how it did.")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first game, the rest count up from it")
+    parser.add_argument("--mode", choices=MODES, default="first")
+    parser.add_argument("--budget", type=float, help="seconds the solver gets per hand")
+    parser.add_argument("--clears", type=int, default=1, help="clears the first-clear search looks for")
+    parser.add_argument("--max-turns", type=int, default=MAX_TURNS, help="hands before a game counts as survived")
+    parser.add_argument("-j", "--jobs", type=int, default=0, help="worker processes, 0 for one per core (default)")
+    parser.add_argument("--games-out", help="write every game's result to this file as JSON lines")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    seeds = range(args.seed, args.seed + args.games)
+    settings = {"mode": args.mode, "time_budget": args.budget, "required_clear_count": args.clears,
+                "max_turns": args.max_turns}
+    started = time.perf_counter()
+    games = list(play_games(seeds, args.jobs, **settings))
+    summary = summarise(games, time.perf_counter() - started)
+
+    if args.games_out:
+        with open(args.games_out, "w") as file:
+            for game in games:
+                file.write(json.dumps(game) + "\n")
+    if args.json:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# Solutions kept on disk between runs, in SQLite so several processes can share one file.
+# A position and its 7 mirror images / rotations all have the same solutions (turned the same way), so every
+# position is stored under its canonical form: whichever of the 8 versions of (board, hand) sorts first, with the
+# hand sorted. A hit is turned back to the position that was asked about.
+import json
+import sqlite3
+import time
+from functools import lru_cache
+
+from bitboard import transpose
+
+MAX_ENTRIES = 200_000
+EVICT_EVERY = 64  # puts between checks on the size limit
+KEEP = 0.9  # share of max_entries left after evicting
+TOUCH_AFTER = 60  # seconds before a hit updates a solution's last use again, so most hits don't write
+
+REVERSED_BYTES = bytes(int(f"{n:08b}"[::-1], 2) for n in range(256))
+
+
+def mirror(bits):
+    # (row, col) -> (row, 7 - col)
+    return int.from_bytes(bits.to_bytes(8, "little").translate(REVERSED_BYTES), "little")
+
+
+def flip(bits):
+    # (row, col) -> (7 - row, col)
+    return int.from_bytes(bits.to_bytes(8, "little"), "big")
+
+
+# The square's 8 symmetries as steps to apply in order. Every step is its own inverse, so a symmetry is undone by
+# applying its steps backwards.
+SYMMETRIES = [(), (mirror,), (flip,), (flip, mirror), (transpose,), (transpose, mirror), (transpose, flip),
+              (transpose, flip, mirror)]
+
+
+def apply(steps, bits):
+    for step in steps:
+        bits = step(bits)
+    return bits
+
+
+def undo(steps, bits):
+    for step in reversed(steps):
+        bits = step(bits)
+    return bits
+
+
+def anchor(mask):
+    # Moves a block's mask to the top left corner, which gives its block id
+    low = (mask & -mask).bit_length() - 1
+    cols = mask | mask >> 32
+    cols |= cols >> 16
+    cols |= cols >> 8
+    cols &= 0xFF
+    return mask >> (low // 8 * 8 + (cols & -cols).bit_length() - 1)
+
+
+@lru_cache(maxsize=4096)
+def turn_block(symmetry, block_id):
+    return anchor(apply(SYMMETRIES[symmetry], block_id))
+
+
+def canonical(bits, block_ids):
+    # (canonical board, canonical hand, index of the symmetry that gives them)
+    best = None
+    for symmetry, steps in enumerate(SYMMETRIES):
+        key = (apply(steps, bits), tuple(sorted(turn_block(symmetry, block_id) for block_id in block_ids)))
+        if best is None or key < best[:2]:
+            best = key + (symmetry,)
+    return best
+
+
+class SolutionCache:
+    # get/put solutions of (board bits, block ids) for a solver mode and required clear count, like
+    # TranspositionTable does for one search. A solution is a search path ((block id, mask), ...), or False for a
+    # position that has none.
+    def __init__(self, path, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.puts = 0
+        # Autocommit, and WAL so readers in other processes aren't blocked while one of them writes
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS solutions (key TEXT PRIMARY KEY, path TEXT, used REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS solutions_used ON solutions (used)")
+
+    def key(self, bits, block_ids, mode, required_clear_count):
+        board, hand, symmetry = canonical(bits, block_ids)
+        return f"{mode}:{required_clear_count}:{board:x}:{','.join(f'{block_id:x}' for block_id in hand)}", symmetry
+
+    def get(self, bits, block_ids, mode, required_clear_count):
+        key, symmetry = self.key(bits, block_ids, mode, required_clear_count)
+        row = self.db.execute("SELECT path, used FROM solutions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] > TOUCH_AFTER:
+            self.db.execute("UPDATE solutions SET used = ? WHERE key = ?", (now, key))
+
+        masks = json.loads(row[0])
+        if masks is None:
+            return False
+        steps = SYMMETRIES[symmetry]
+        path = []
+        for mask in masks:
+            mask = undo(steps, mask)
+            path.append((anchor(mask), mask))
+        return tuple(path)
+
+    def put(self, bits, block_ids, mode, required_clear_count, path):
+        key, symmetry = self.key(bits, block_ids, mode, required_clear_count)
+        masks = None if path is False else [apply(SYMMETRIES[symmetry], mask) for _, mask in path]
+        self.db.execute("INSERT OR REPLACE INTO solutions VALUES (?, ?, ?)", (key, json.dumps(masks), time.time()))
+
+        self.puts += 1
+        if not self.puts % EVICT_EVERY:
+            self.evict()
+
+    def evict(self):
+        # Drops the least recently used solutions once there are more than max_entries
+        count = self.db.execute("SELECT count(*) FROM solutions").fetchone()[0]
+        if count > self.max_entries:
+            self.db.execute("DELETE FROM solutions WHERE key IN (SELECT key FROM solutions ORDER BY used LIMIT ?)",
+                            (count - int(self.max_entries * KEEP),))
+
+    def __len__(self):
+        return self.db.execute("SELECT count(*) FROM solutions").fetchone()[0]
+
+    def clear(self):
+        self.db.execute("DELETE FROM solutions")
+
+    def close(self):
+        self.db.close()
+
+
+@lru_cache(maxsize=None)
+def open_cache(path):
+    # One connection per file per process, for callers that only have the path (like batch workers)
+    return SolutionCache(path)
@@ -0,0 +1,206 @@
+# Headless solver: plain grids in, plain results out, plus a command line for solving batches of cases.
+# Nothing here imports pygame, so it starts quickly and runs without a display.
+import argparse
+import json
+import sys
+import time
+
+from ai import OutOfTime, search_moves, search_best_moves, iter_moves, solution_score, score_board, to_moves
+from bitboard import to_bits, to_board, shape_key, block_mask
+from cases import parse_case, read_cases
+from lookahead import ROUNDS, search_lookahead
+from parallel import ParallelSearch
+from search_stats import SearchStats
+from solution_cache import open_cache
+
+MODES = ("first", "best", "lookahead")
+
+
+def solve(board, pieces, mode="first", required_clear_count=1, time_budget=None, table=None, stats=None,
+          workers=None, cache=None, alternatives=0, split=None):
+    # Solves one position. board is the 8x8 grid and pieces the grids of the blocks in hand (blank ones are skipped).
+    # mode "first" works like make_moves, "best" like best_moves and "lookahead" like lookahead_moves (the result
+    # gets a "survival" entry). Each gets time_budget seconds: "first" gives up when it runs out, the others return
+    # the best placement found by then. table is the transposition table "first" uses (the shared one by default).
+    # workers is the number of processes lookahead plays its rounds in. If a SearchStats is passed as stats, it's
+    # filled in and the result gets a "stats" entry with its counters. cache is an optional SolutionCache that
+    # "first" and "best" answers come from and go to (only finished searches are stored), and adds a "cached" entry.
+    # alternatives adds that many of the best scoring distinct solutions (see solutions) as an "alternatives" entry,
+    # looked for in another time_budget. split is an optional ParallelSearch to split "first" and "best" searches over
+    # (its workers' nodes don't make it into stats).
+    start = time.perf_counter()
+    shapes = [shape_key(piece) for piece in pieces]
+    hand = [n for n, shape in enumerate(shapes) if shape]
+    bits = to_bits(board)
+
+    optimal = None
+    timed_out = False
+    search_stats = SearchStats(detail=False) if stats is None else stats
+    cached = None
+    if cache is not None and mode in ("first", "best"):
+        block_ids = [block_mask(shapes[n]) for n in hand]
+        cached = cache.get(bits, block_ids, mode, required_clear_count)
+
+    if cached is not None:
+        found = None if cached is False else (None, cached)
+        optimal = True if mode == "best" else None
+    elif mode == "first":
+        try:
+            if split is None:
+                found, _ = search_moves(bits, [shapes[n] for n in hand], required_clear_count, table, time_budget,
+                                        search_stats)
+            else:
+                found, _ = split.search_moves(bits, [shapes[n] for n in hand], required_clear_count, time_budget)
+        except OutOfTime:
+            found, timed_out = None, True
+    elif mode == "best":
+        if split is None:
+            found, _, optimal = search_best_moves(bits, [shapes[n] for n in hand], time_budget, search_stats)
+        else:
+            found, _, optimal = split.search_best_moves(bits, [shapes[n] for n in hand], time_budget)
+        timed_out = not optimal
+    elif mode == "lookahead":
+        found, outlook = search_lookahead(bits, [shapes[n] for n in hand], time_budget, workers=workers)
+        timed_out = outlook is not None and outlook["rounds"] < ROUNDS
+    else:
+        raise ValueError(f"Unknown solver mode {mode!r}")
+
+    if cache is not None and cached is None and mode in ("first", "best") and not timed_out:
+        cache.put(bits, block_ids, mode, required_clear_count, False if found is None else found[1])
+
+    if found is None:
+        result = {"solved": False, "cleared": False, "moves": [], "board": None, "clears": 0, "score": None,
+                  "optimal": optimal, "timed_out": timed_out}
+    else:
+        moves, final_bits = describe_moves(bits, found[1], [block_mask(shape) for shape in shapes], hand)
+        clears = sum(move["clears"] for move in moves)
+        result = {
+            "solved": True,
+            "cleared": clears >= required_clear_count,
+            "moves": moves,
+            "board": to_board(final_bits),
+            "clears": clears,
+            "score": score_board(final_bits, clears),
+            "optimal": optimal,
+            "timed_out": timed_out,
+        }
+
+    if alternatives:
+        result["alternatives"] = list(solutions(board, pieces, required_clear_count if result["cleared"] else 0,
+                                                alternatives, True, time_budget))
+    if mode == "lookahead":
+        result["survival"] = None if outlook is None else outlook["survival"]
+    if cache is not None:
+        result["cached"] = cached is not None
+    result["nodes"] = search_stats.nodes
+    result["seconds"] = time.perf_counter() - start
+    if stats is not None:
+        result["stats"] = stats.as_dict()
+    return result
+
+
+def solutions(board, pieces, required_clear_count=1, limit=None, by_score=False, time_budget=None):
+    # Yields the distinct solutions of one position (one per final board) as they're found, each described like
+    # solve's result: {"moves", "board", "clears", "score"}. Only the ones with the required clears, and at most
+    # limit of them. by_score searches everything first (or until time_budget runs out) and yields the best first.
+    shapes = [shape_key(piece) for piece in pieces]
+    hand = [n for n, shape in enumerate(shapes) if shape]
+    block_ids = [block_mask(shape) for shape in shapes]
+    bits = to_bits(board)
+    for final_bits, path, clears in iter_moves(bits, [shapes[n] for n in hand], required_clear_count, limit,
+                                               solution_score if by_score else None, time_budget):
+        moves, _ = describe_moves(bits, path, block_ids, hand)
+        yield {"moves": moves, "board": to_board(final_bits), "clears": clears,
+               "score": score_board(final_bits, clears)}
+
+
+def describe_moves(bits, path, block_ids, hand):
+    # to_moves as plain dicts, for JSON
+    moves, bits = to_moves(bits, path, block_ids, hand)
+    return [move._asdict() for move in moves], bits
+
+
+def open_sources(files):
+    # Yields (name, open file) for each path, with "-" or no paths at all meaning stdin
+    if not files:
+        files = ["-"]
+    for path in files:
+        if path == "-":
+            yield "<stdin>", sys.stdin
+        else:
+            with open(path) as file:
+                yield path, file
+
+
+def solve_line(line, mode="first", required_clear_count=1, time_budget=None, stats=False, profile=False,
+               workers=None, cache=None, alternatives=0, split=None):
+    # solve for one cases.txt line, with an error entry instead of a result if it can't be read.
+    # stats adds the search's counters to the result, profile prints where the search spent its time to stderr.
+    # cache is the path of a solution cache file to use.
+    try:
+        board, pieces = parse_case(line)
+    except ValueError as e:
+        return {"error": str(e)}
+    search_stats = SearchStats(profile=profile) if stats or profile else None
+    result = solve(board, pieces, mode, required_clear_count, time_budget, stats=search_stats, workers=workers,
+                   cache=None if cache is None else open_cache(cache), alternatives=alternatives, split=split)
+    if profile:
+        sys.stderr.write(search_stats.profile_report())
+    if not stats:
+        result.pop("stats", None)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Solve cases.txt style lines (board|piece|piece|piece) and write one JSON result per line.")
+    parser.add_argument("files", nargs="*", help="case files to read (stdin if none are given, or for -)")
+    modes = parser.add_mutually_exclusive_group()
+    modes.add_argument("--best", action="store_true",
+                       help="look for the best scoring placement instead of the first one with a clear")
+    modes.add_argument("--lookahead", action="store_true",
+                       help="pick the placement that does best over sampled future hands")
+    parser.add_argument("--timeout", "--budget", type=float,
+                        help="seconds to spend on each case (--best answers with the best placement found so far)")
+    parser.add_argument("--clears", type=int, default=1, help="clears a solution needs (default: 1)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="worker processes to solve with, 0 for one per core (default: 1)")
+    parser.add_argument("--chunk-size", type=int, default=16, help="cases handed to a worker at a time")
+    parser.add_argument("--unordered", action="store_true",
+                        help="write results as they finish instead of in input order")
+    parser.add_argument("--stats", action="store_true", help="add the search's counters to every result")
+    parser.add_argument("--top", type=int, default=0, metavar="K",
+                        help="add the K best scoring distinct solutions of every case as alternatives")
+    parser.add_argument("--cache", help="solution cache file to reuse answers from (created if missing)")
+    parser.add_argument("--profile", action="store_true",
+                        help="profile every search and print the report to stderr (runs with a single job)")
+    parser.add_argument("--split", type=int, metavar="N",
+                        help="split every first/best search over N processes, 0 for one per core (runs with a "
+                             "single job, for a few hard cases)")
+    args = parser.parse_args(argv)
+
+    mode = "best" if args.best else "lookahead" if args.lookahead else "first"
+    cases = (((name, number), line) for name, file in open_sources(args.files) for number, line in read_cases(file))
+
+    split = None if args.split is None else ParallelSearch(args.split or None)
+    if args.jobs == 1 or args.profile or split is not None:
+        results = (((name, number), solve_line(line, mode, args.clears, args.timeout, args.stats, args.profile,
+                                               cache=args.cache, alternatives=args.top, split=split))
+                   for (name, number), line in cases)
+    else:
+        from batch import solve_batch  # batch imports this module for its workers
+        results = solve_batch(cases, args.jobs, args.chunk_size, mode, args.clears, args.timeout,
+                              ordered=not args.unordered, stats=args.stats, cache=args.cache,
+                              alternatives=args.top)
+
+    for (name, number), result in results:
+        output = {"file": name, "line": number}
+        output.update(result)
+        sys.stdout.write(json.dumps(output) + "\n")
+        sys.stdout.flush()
+    if split is not None:
+        split.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,9 @@ class Selection:
         self.h_height = self.height / 2
         self.hitbox = pygame.Rect((x, y, self.width, self.height))
         self.surface = pygame.Surface((self.width, self.height))
+        self.version = 0  # goes up every time the surface is redrawn, so the game knows to push it to the screen
+        self.drawn = None  # what the surface shows right now
+        self.sprites = {}  # hover surfaces already drawn, by (tile size, color, tile_data)
 
         self.tile_size = tile_size
 
@@ -44,7 +47,9 @@ class Selection:
         return return_str
 
     def draw_selection(self):
-        if self.blank:
+        if self.blank and self.drawn != ("blank", self.hovered_over):
+            self.drawn = ("blank", self.hovered_over)
+            self.version += 1
             self.surface.fill((66, 93, 159))
             if not self.hovered_over:
                 pygame.draw.rect(self.surface, (24, 36, 74), (0, 0, self.width, self.height), self.line_width)
@@ -145,6 +150,11 @@ class Selection:
             self.tile_data.append([0] * 5)
 
     def hover_surface(self, tile_size, color):
+        # Drawn once per shape, size and color, since it gets asked for every frame while the tile is held
+        key = (tile_size, color, tuple(map(tuple, self.tile_data)))
+        if key in self.sprites:
+            return self.sprites[key]
+
         self.trim_data()
         length = max(len(self.tile_data), len(self.tile_data[0]))
         length *= tile_size
@@ -161,10 +171,13 @@ class Selection:
                                       self.tile_size),
                                      border_radius=4)
 
+        self.sprites[(tile_size, color, tuple(map(tuple, self.tile_data)))] = surf
         return surf
 
     def create_tile_surface(self):
         self.trim_data()
+        self.drawn = "tile"
+        self.version += 1
 
         try:
             self.surface.fill((66, 93, 159))
@@ -179,5 +192,6 @@ class Selection:
                                          border_radius=4)
 
         except IndexError:
+            self.drawn = None
             self.blank = True
             self.tile_data = [[0 for i in range(5)] for j in range(5)]
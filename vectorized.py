@@ -0,0 +1,90 @@
+# Bitboard helpers for numpy arrays of boards, for when thousands of boards need the same work done.
+# Boards are uint64 arrays holding the same bits as bitboard's ints. numpy is optional: check `available` first,
+# everything else in the solver works without it.
+from functools import lru_cache
+
+from bitboard import ROW_MASKS, COL_MASKS, placements
+from ai import CLEAR_SCORE, EMPTY_SCORE, FRAGMENT_SCORE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+available = np is not None
+
+if available:
+    FIRST_COL = np.uint64(COL_MASKS[0])
+    FIRST_ROW = np.uint64(ROW_MASKS[0])
+    NOT_LAST_COL = np.uint64(~COL_MASKS[7] & (1 << 64) - 1)
+    NOT_LAST_ROW = np.uint64(~ROW_MASKS[7] & (1 << 64) - 1)
+    BYTE_COUNTS = np.array([bin(n).count("1") for n in range(256)], dtype=np.uint8)
+
+
+def popcount(a):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(a).astype(np.int64)
+    a = np.ascontiguousarray(a, dtype=np.uint64)
+    return BYTE_COUNTS[a.view(np.uint8)].reshape(a.shape + (8,)).sum(axis=-1, dtype=np.int64)
+
+
+def to_array(boards):
+    # Bitboard ints to a uint64 array
+    return np.fromiter(boards, dtype=np.uint64)
+
+
+@lru_cache(maxsize=None)
+def placement_masks(shape):
+    # placements(shape)'s masks as an array
+    return np.array([mask for _, _, mask in placements(shape)], dtype=np.uint64)
+
+
+def clear_lines(bits):
+    # bitboard.clear_lines for every board in the array: (boards after clearing, lines cleared)
+    rows = bits & (bits >> np.uint64(1))
+    rows &= rows >> np.uint64(2)
+    rows &= rows >> np.uint64(4)
+    rows &= FIRST_COL
+
+    cols = bits & (bits >> np.uint64(8))
+    cols &= cols >> np.uint64(16)
+    cols &= cols >> np.uint64(32)
+    cols &= FIRST_ROW
+
+    full = rows * FIRST_ROW | cols * FIRST_COL
+    return bits & ~full, popcount(rows) + popcount(cols)
+
+
+def fragmentation(bits):
+    across = (bits ^ (bits >> np.uint64(1))) & NOT_LAST_COL
+    down = (bits ^ (bits >> np.uint64(8))) & NOT_LAST_ROW
+    return popcount(across) + popcount(down)
+
+
+def score_boards(bits, clears):
+    # ai.score_board for every board in the array
+    return clears * CLEAR_SCORE + (64 - popcount(bits)) * EMPTY_SCORE - fragmentation(bits) * FRAGMENT_SCORE
+
+
+def place(boards, shape):
+    # Every legal placement of the shape on every board, in one pass.
+    # Returns (board index, mask, board after clearing, lines cleared), one array entry per placement.
+    masks = placement_masks(shape)
+    fits = (boards[:, None] & masks[None, :]) == 0
+    board_index, spot = np.nonzero(fits)
+    new_boards, lines = clear_lines(boards[board_index] | masks[spot])
+    return board_index, masks[spot], new_boards, lines
+
+
+def best_placements(boards, shape):
+    # The best scoring placement of the shape on every board (the first of equals, like a loop over placements would
+    # pick). Returns (board after clearing, lines cleared, whether it fit at all); boards it doesn't fit on are
+    # returned unchanged.
+    masks = placement_masks(shape)
+    fits = (boards[:, None] & masks[None, :]) == 0
+    new_boards, lines = clear_lines(boards[:, None] | masks[None, :])
+    scores = np.where(fits, score_boards(new_boards, lines), np.iinfo(np.int64).min)
+    best = scores.argmax(axis=1)
+    fit = fits.any(axis=1)
+    rows = np.arange(len(boards))
+    return np.where(fit, new_boards[rows, best], boards), np.where(fit, lines[rows, best], 0), fit